@@ -1,5 +1,6 @@
 from tokenizer import *
 from instructions import *
+import os
 
 class Program:
     def __init__(self):
@@ -7,119 +8,160 @@ class Program:
         self.external: Reference | None = None
         self.view: Reference | None = None
         self.initial_data: Block | None = None
-        self.code: list[Instruction | Section] = []
+        self.code: list[Instruction | Section | Include] = []
+        # Index into code where internal, external, view and data were last set, so linking keeps their order against includes
+        self.positions: dict[str, int] = {}
 
 class Analyser:
-    def __init__(self, tokens: list[Token]):
+    def __init__(self, tokens: TokenStream, path: str | None = None, follow_includes: bool = True):
         self.tokens = tokens
         self.i = 0
+        self.file = os.path.realpath(path) if path is not None else None
+        self.streams: list[tuple[TokenStream, int, str | None]] = []
+        self.included: set[str] = set()
+        self.sources: dict[str, Source] = {}
+        self.follow_includes = follow_includes
+        self.sections: set[str] = set()
+        if self.file is not None:
+            self.included.add(self.file)
+            self.sources[self.file] = tokens.source
         self.program = Program()
 
     def d(self):
+        if self.i < len(self.tokens):
+            return True
+        while self.i >= len(self.tokens) and self.streams:
+            self.tokens, self.i, self.file = self.streams.pop()
         return self.i < len(self.tokens)
     
     def advance(self):
         self.i += 1
 
-    def c(self):
-        return self.tokens[self.i]
+    def error(self, message: str):
+        return Exception(f'{self.tokens.describe(self.i)}: {message}')
+
+    def resolve(self, include: str):
+        if self.file is not None:
+            include = os.path.join(os.path.dirname(self.file), include)
+        return os.path.realpath(include)
+
+    def include(self, path: str):
+        active = [file for _, _, file in self.streams] + [self.file]
+        if path in active:
+            chain = active[active.index(path):] + [path]
+            raise Exception('Include cycle: ' + ' -> '.join(chain))
+        if path in self.included:
+            return
+        self.included.add(path)
+        if not self.follow_includes:
+            self.program.code.append(Include(path))
+            return
+        self.streams.append((self.tokens, self.i, self.file))
+        self.tokens, self.i, self.file = tokenize_file(path), 0, path
+        self.sources[path] = self.tokens.source
     
     def execute_macros(self):
-        if not isinstance(self.c(), TokenMacros):
+        if self.tokens.types[self.i] != MACROS_ID:
             return False
-        macros: TokenMacros = self.c()
+        name = self.tokens.lexeme(self.i)
+        macro = '.' + name
+        if name not in ('internal', 'external', 'view', 'data', 'include', 'bytes'):
+            raise self.error(f"Unknown macro '{macro}'")
         self.advance()
-        if macros.name == 'internal':
-            if not isinstance(self.c(), TokenReference):
-                raise Exception('Need reference in internal')
-            reference: TokenReference = self.c()
-            self.advance()
-            self.program.internal = Reference(reference.name)
-        elif macros.name == 'external':
-            if not isinstance(self.c(), TokenReference):
-                raise Exception('Need reference in external')
-            reference: TokenReference = self.c()
-            self.advance()
-            self.program.external = Reference(reference.name)
-        elif macros.name == 'view':
-            if not isinstance(self.c(), TokenReference):
-                raise Exception('Need reference in view')
-            reference: TokenReference = self.c()
-            self.advance()
-            self.program.view = Reference(reference.name)
-        elif macros.name == 'data':
-            if isinstance(self.c(), TokenString):
-                string: TokenString = self.c()
-                self.advance()
-                self.program.initial_data = Block(string.value.encode('utf-8'))
-            elif isinstance(self.c(), TokenBlock):
-                block: TokenBlock = self.c()
-                self.advance()
-                self.program.initial_data = Block(bytes.fromhex(block.value))
-            else:
-                raise Exception('Need data in data, yeah :\\')
-        elif macros.name == 'include':
-            if not isinstance(self.c(), TokenString):
-                raise Exception('Include need string')
-            include_file: TokenString = self.c()
-            self.advance()
-            with open(include_file.value, encoding='utf-8') as f:
-                tokenizer = Tokenizer(f.read())
-                tokenizer.parse()
-                new_tokens = self.tokens[:self.i]
-                new_tokens.extend(tokenizer.tokens)
-                new_tokens.extend(self.tokens[self.i:])
-                self.tokens = new_tokens
+        if name in ('internal', 'external', 'view', 'data'):
+            self.program.positions[name] = len(self.program.code)
+        if name == 'internal':
+            self.program.internal = self.parse_reference(macro, 0)
+        elif name == 'external':
+            self.program.external = self.parse_reference(macro, 0)
+        elif name == 'view':
+            self.program.view = self.parse_reference(macro, 0)
+        elif name == 'data':
+            self.program.initial_data = self.parse_block(macro, 0)
+        elif name == 'include':
+            _, include_file = self.operand(macro, (STRING_ID,), 'a string')
+            self.include(self.resolve(include_file))
+        elif name == 'bytes':
+            location = (self.tokens.source, self.tokens.starts[self.i - 1])
+            instruction = RawInstruction(self.parse_block(macro, 0).bt)
+            instruction.location = location
+            self.program.code.append(instruction)
         return True
     
     def add_section(self):
-        if not isinstance(self.c(), TokenSection):
+        if self.tokens.types[self.i] != SECTION_ID:
             return False
-        section: TokenSection = self.c()
+        name = self.tokens.lexeme(self.i)
+        if name in self.sections:
+            raise self.error(f"Section '{name}' defined twice")
+        self.sections.add(name)
+        self.program.code.append(Section(name))
         self.advance()
-        self.program.code.append(Section(section.name))
         return True
-    
+
+    def operand(self, name: str, kinds: tuple[int, ...], expected: str):
+        if self.i >= len(self.tokens):
+            raise self.error(f'{name} expects {expected}, got end of file')
+        type = self.tokens.types[self.i]
+        if type not in kinds:
+            raise self.error(f"{name} expects {expected}, got {TOKEN_NAMES[type]} '{self.tokens.text(self.i)}'")
+        lexeme = self.tokens.lexeme(self.i)
+        self.advance()
+        return type, lexeme
+
+    def parse_number(self, name: str, size: int):
+        _, lexeme = self.operand(name, (NUMBER_ID,), 'a number')
+        try:
+            value = int(lexeme)
+        except ValueError:
+            self.i -= 1
+            raise self.error(f"Invalid number '{lexeme}' for {name}")
+        if size and value >= 1 << 8 * size:
+            self.i -= 1
+            raise self.error(f'{name} operand {value} does not fit in {8 * size} bits')
+        return Number(value)
+
+    def parse_index(self, name: str, size: int):
+        _, lexeme = self.operand(name, (INDEX_ID,), 'an index')
+        if not lexeme:
+            self.i -= 1
+            raise self.error(f"Missing value after '#' for {name}")
+        value = int(lexeme)
+        if value >= 1 << 8 * size:
+            self.i -= 1
+            raise self.error(f'{name} index #{value} does not fit in {8 * size} bits')
+        return Index(value)
+
+    def parse_block(self, name: str, size: int):
+        type, lexeme = self.operand(name, (STRING_ID, BLOCK_ID), 'a string or a hex block')
+        if type == STRING_ID:
+            return Block(lexeme.encode('utf-8'))
+        try:
+            return Block(bytes.fromhex(lexeme))
+        except ValueError:
+            self.i -= 1
+            raise self.error(f"Invalid hex block '[{lexeme}]' for {name}")
+
+    def parse_reference(self, name: str, size: int):
+        _, lexeme = self.operand(name, (REFERENCE_ID,), 'a reference')
+        if not lexeme:
+            self.i -= 1
+            raise self.error(f"Missing section name after '&' for {name}")
+        return Reference(lexeme)
+
     def parse_instruction(self):
-        if not isinstance(self.c(), TokenInstruction):
+        if self.tokens.types[self.i] != INSTRUCTION_ID:
             return False
-        token_instruction: TokenInstruction = self.c()
+        name = self.tokens.lexeme(self.i)
+        entry = INSTRUCTION_TABLE.get(name)
+        if entry is None:
+            raise self.error(f"Unknown instruction '{name}'")
+        factory, parsers = entry
+        start = self.tokens.starts[self.i]
         self.advance()
-        instruction_factory = INSTRUCTIONS[token_instruction.name]
-        if isinstance(instruction_factory, IPush):
-            if isinstance(self.c(), TokenNumber):
-                number: TokenNumber = self.c()
-                self.program.code.append(instruction_factory.build(Number(number.to_int())))
-                self.advance()
-        elif isinstance(instruction_factory, Stackable):
-            if isinstance(self.c(), TokenIndex):
-                index: TokenIndex = self.c()
-                self.program.code.append(instruction_factory.build(Index(index.to_int())))
-                self.advance()
-        elif isinstance(instruction_factory, BPush):
-            if isinstance(self.c(), TokenString):
-                string: TokenString = self.c()
-                self.program.code.append(instruction_factory.build(Block(string.value.encode('utf-8'))))
-                self.advance()
-            elif isinstance(self.c(), TokenBlock):
-                block: TokenBlock = self.c()
-                self.program.code.append(instruction_factory.build(Block(bytes.fromhex(block.value))))
-                self.advance()
-        elif isinstance(instruction_factory, Change):
-            if isinstance(self.c(), TokenIndex):
-                first: TokenIndex = self.c()
-                self.advance()
-                if isinstance(self.c(), TokenIndex):
-                    second: TokenIndex = self.c()
-                    self.program.code.append(instruction_factory.build(Index(first.to_int()), Index(second.to_int())))
-                    self.advance()
-        elif isinstance(instruction_factory, Jmp):
-            if isinstance(self.c(), TokenReference):
-                reference: TokenReference = self.c()
-                self.program.code.append(instruction_factory.build(Reference(reference.name)))
-                self.advance()
-        elif isinstance(instruction_factory, InstructionFactory):
-            self.program.code.append(instruction_factory.build())
+        instruction = factory.build(*[parser(self, name, size) for parser, size in parsers])
+        instruction.location = (self.tokens.source, start)
+        self.program.code.append(instruction)
         return True
 
     def analys(self):
@@ -130,4 +172,18 @@ class Analyser:
                 continue
             if self.parse_instruction():
                 continue
-            self.advance()
\ No newline at end of file
+            type = self.tokens.types[self.i]
+            raise self.error(f"Unexpected {TOKEN_NAMES[type]} '{self.tokens.text(self.i)}'")
+
+OPERAND_PARSERS = {
+    'number': Analyser.parse_number,
+    'index': Analyser.parse_index,
+    'block': Analyser.parse_block,
+    'reference': Analyser.parse_reference,
+}
+
+# Mnemonic -> (factory, operand parsers with their sizes), built once from the schemas
+INSTRUCTION_TABLE = {
+    name: (factory, tuple((OPERAND_PARSERS[kind], size) for kind, size in factory.operands))
+    for name, factory in INSTRUCTIONS.items()
+}
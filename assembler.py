@@ -0,0 +1,113 @@
+from tokenizer import tokenize_file
+from analyser import Analyser
+from compiler import Compiler, build_executive
+from optimizer import Optimizer
+from stackcheck import StackChecker
+from buildcache import BuildCache, cache_entry
+from sourcemap import SourceMap
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import glob
+import hashlib
+import os
+
+class Options:
+    def __init__(self, optimize: bool = False, relax: bool = False, dead_code: bool = False, check_stack: bool = False, inline: int | None = None):
+        self.optimize = optimize
+        self.relax = relax
+        self.dead_code = dead_code
+        self.check_stack = check_stack
+        self.inline = inline
+
+    def to_json(self):
+        return dict(vars(self))
+
+class Assembly:
+    def __init__(self, source: str, program: bytes, initial_data: bytes | None, references: dict[str, int] | None = None):
+        self.source = source
+        self.program = program
+        self.initial_data = initial_data
+        self.references = references if references is not None else {}
+        self.report: str | None = None
+        self.stack_depths: dict[str, int] | None = None
+        self.executive: bytes | None = None
+        self.address: bytes | None = None
+        self.source_map: SourceMap | None = None
+        if initial_data is not None:
+            self.executive = build_executive(program, initial_data)
+            self.address = hashlib.sha256(self.executive).digest()
+
+    def to_json(self):
+        record = {
+            'source': self.source,
+            'program': self.program.hex(),
+            'data': self.initial_data.hex() if self.initial_data is not None else None,
+            'executive': self.executive.hex() if self.executive is not None else None,
+            'address': self.address.hex() if self.address is not None else None,
+        }
+        if self.stack_depths is not None:
+            record['stack'] = self.stack_depths
+        return record
+
+# A source map needs the analysed program, so it always misses the cache
+def assemble_file(path: str, options: Options | None = None, cache: BuildCache | None = None, source_map: bool = False):
+    options = options if options is not None else Options()
+    if cache is not None and not source_map:
+        entry = cache.get(path, options.to_json())
+        if entry is not None:
+            assembly = Assembly(path, entry.program, entry.initial_data, entry.references)
+            assembly.stack_depths = entry.stack_depths
+            assembly.report = entry.report
+            return assembly
+    analyser = Analyser(tokenize_file(path), path)
+    analyser.analys()
+    optimizer = None
+    if options.optimize or options.dead_code or options.inline is not None:
+        optimizer = Optimizer(analyser.program)
+        if options.inline is not None:
+            optimizer.inline(options.inline)
+        if options.optimize or options.inline is not None:
+            optimizer.optimize()
+        if options.dead_code:
+            optimizer.eliminate_dead_code()
+    stack_depths = None
+    if options.check_stack:
+        stack_depths = StackChecker(analyser.program).check()
+    compiler = Compiler(analyser.program, options.relax)
+    program = compiler.compile()
+    initial_data = analyser.program.initial_data
+    assembly = Assembly(path, bytes(program), initial_data.bt if initial_data is not None else None, compiler.references)
+    assembly.report = optimizer.report() if optimizer is not None else None
+    assembly.stack_depths = stack_depths
+    if source_map:
+        assembly.source_map = compiler.source_map()
+    if cache is not None:
+        cache.put(path, options.to_json(), cache_entry(analyser.sources, assembly.program, assembly.initial_data, assembly.references, stack_depths, assembly.report))
+    return assembly
+
+def assemble_record(path: str, options: Options | None = None, cache: BuildCache | None = None):
+    try:
+        return assemble_file(path, options, cache).to_json()
+    except Exception as e:
+        return {'source': path, 'error': f'{type(e).__name__}: {e}'}
+
+def expand_sources(patterns: list[str]):
+    sources = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            sources.extend(sorted(glob.glob(os.path.join(pattern, '**', '*.tfsm'), recursive=True)))
+        elif glob.has_magic(pattern):
+            sources.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            sources.append(pattern)
+    return sources
+
+def assemble_batch(sources: list[str], jobs: int | None = None, options: Options | None = None, cache: BuildCache | None = None):
+    record = functools.partial(assemble_record, options=options, cache=cache)
+    if jobs == 1:
+        yield from map(record, sources)
+        return
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(sources) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(record, sources, chunksize=chunksize)
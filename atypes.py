@@ -8,6 +8,16 @@ class Section:
     def __repr__(self):
         return self.__str__()
 
+class Include:
+    def __init__(self, path: str):
+        self.path = path
+
+    def __str__(self):
+        return f'.include "{self.path}"'
+    
+    def __repr__(self):
+        return self.__str__()
+
 class Reference:
     def __init__(self, name: str):
         self.name = name
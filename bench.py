@@ -0,0 +1,145 @@
+from tokenizer import TOKEN_CACHE, tokenize_file
+from analyser import Analyser
+from compiler import Compiler
+from optimizer import Optimizer
+from vm import Machine, Message, EXTERNAL
+from assembler import assemble_file
+from synthetic import generate
+from codec import Schema
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SCENARIOS = {
+    'flat': {},
+    'includes': {'include_depth': 6, 'include_fanout': 2},
+    'data': {'data_size': 1 << 20},
+}
+
+VM_BODY = Schema.parse('receiver:block,body:block').encode((bytes(32), b'ping'))
+
+def analysed(root: str):
+    analyser = Analyser(tokenize_file(root), root)
+    analyser.analys()
+    return analyser.program
+
+def sources(directory: str):
+    TOKEN_CACHE.clear()
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+
+def warm(directory: str, root: str):
+    for path in sources(directory):
+        tokenize_file(path)
+    return root
+
+def stages(directory: str, root: str):
+    return {
+        'tokenize': (lambda: sources(directory), lambda paths: [tokenize_file(path) for path in paths]),
+        'analyse': (lambda: warm(directory, root), lambda path: Analyser(tokenize_file(path), path).analys()),
+        'optimize': (lambda: analysed(root), lambda program: Optimizer(program).optimize()),
+        'compile': (lambda: analysed(root), lambda program: Compiler(program).compile()),
+        'relax': (lambda: analysed(root), lambda program: Compiler(program, relax=True).compile()),
+        'decode': (lambda: bytes(Compiler(analysed(root)).compile()), lambda program: Machine(program)),
+    }
+
+def measure(setup, run, repeat: int):
+    best = None
+    for _ in range(repeat):
+        value = setup()
+        gc.collect()
+        start = time.perf_counter()
+        run(value)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    value = setup()
+    gc.collect()
+    tracemalloc.start()
+    run(value)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+# Messages per second through one contract entry, with and without superinstruction fusion
+def interpreter(path: str, body: bytes, runs: int, repeat: int):
+    assembly = assemble_file(path)
+    message = Message(EXTERNAL, b'', assembly.address or b'', b'', 0, body, 0)
+    result = {'contract': path, 'runs': runs}
+    for fuse in (False, True):
+        machine = Machine(assembly.program, assembly.address or b'', fuse=fuse)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(runs):
+                machine.run('external', assembly.initial_data or b'', message)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        label = 'fused' if fuse else 'plain'
+        result[label] = {'seconds': best, 'messages_per_second': runs / best, 'fusions': machine.fusion_stats()}
+        print(f'{os.path.basename(path):<16} {label:<6} {runs / best:>12.0f} msg/s', file=sys.stderr)
+    for name, sites, fired in result['fused']['fusions']:
+        print(f'  {name:<24} {sites:>4} sites {fired:>10} fired', file=sys.stderr)
+    print(f'  speedup x{result["plain"]["seconds"] / result["fused"]["seconds"]:.2f}', file=sys.stderr)
+    return result
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: list[dict], baseline: dict):
+    old = {(r['scenario'], r['instructions'], stage): value for r in baseline['results'] for stage, value in r['stages'].items()}
+    for result in results:
+        for stage, value in result['stages'].items():
+            before = old.get((result['scenario'], result['instructions'], stage))
+            if before is not None and before['seconds']:
+                print(f'{result["scenario"]:<9} {result["instructions"]:>8} {stage:<9} x{value["seconds"] / before["seconds"]:.2f} time  x{value["peak_bytes"] / max(1, before["peak_bytes"]):.2f} memory')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-s', '--sizes', default='1000,10000,100000', help='comma separated instruction counts')
+parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+parser.add_argument('--stages', help='comma separated subset of stages to run')
+parser.add_argument('-n', '--repeat', type=int, default=3)
+parser.add_argument('-o', '--output', help='write results as JSON to this file')
+parser.add_argument('--compare', help='baseline JSON from an earlier run')
+parser.add_argument('--vm', help='also time the external entry of this contract with fusion on and off')
+parser.add_argument('--vm-runs', type=int, default=10000)
+parser.add_argument('--vm-body', help='hex message body, defaults to a (receiver, body) pair of blocks as the examples read')
+args = parser.parse_args()
+
+results = []
+for scenario in args.scenarios.split(','):
+    for size in [int(size) for size in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as directory:
+            root = generate(directory, size, **SCENARIOS[scenario])
+            source_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+            result = {'scenario': scenario, 'instructions': size, 'files': len(os.listdir(directory)), 'source_bytes': source_bytes, 'stages': {}}
+            for stage, (setup, run) in stages(directory, root).items():
+                if args.stages is not None and stage not in args.stages.split(','):
+                    continue
+                result['stages'][stage] = measure(setup, run, args.repeat)
+                value = result['stages'][stage]
+                print(f'{scenario:<9} {size:>8} {stage:<9} {1000 * value["seconds"]:>10.2f} ms {value["peak_bytes"] / 1e6:>9.2f} MB', file=sys.stderr)
+            results.append(result)
+            TOKEN_CACHE.clear()
+
+report = {
+    'commit': commit(),
+    'interpreter': interpreter(args.vm, bytes.fromhex(args.vm_body) if args.vm_body is not None else VM_BODY, args.vm_runs, args.repeat) if args.vm is not None else None,
+    'python': platform.python_version(),
+    'time': time.time(),
+    'results': results,
+}
+if args.output is not None:
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+if args.compare is not None:
+    with open(args.compare, encoding='utf-8') as f:
+        compare(results, json.load(f))
@@ -0,0 +1,196 @@
+from objectfile import write_uint, write_block, write_optional, read_exact, read_uint, read_block, read_optional
+from tokenizer import Source
+import functools
+import hashlib
+import json
+import os
+import tempfile
+
+CACHE_MAGIC = b'TFSC'
+CACHE_VERSION = 2
+DEFAULT_MAX_SIZE = 256 << 20
+
+# Modules whose code decides the bytes of an executive
+PIPELINE = ('atypes', 'tokenizer', 'analyser', 'instructions', 'cfg', 'optimizer', 'stackcheck', 'compiler', 'assembler')
+
+@functools.cache
+def assembler_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in PIPELINE:
+        with open(os.path.join(directory, name + '.py'), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+# Digests are taken over the decoded text the tokenizer sees
+def text_digest(text: str):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+def file_digest(path: str):
+    with open(path, encoding='utf-8') as f:
+        return text_digest(f.read())
+
+class CacheEntry:
+    def __init__(self, program: bytes, initial_data: bytes | None, references: dict[str, int], stack_depths: dict[str, int] | None, includes: dict[str, bytes], report: str | None = None):
+        self.program = program
+        self.initial_data = initial_data
+        self.references = references
+        self.stack_depths = stack_depths
+        self.includes = includes
+        self.report = report
+
+    def save(self, stream):
+        stream.write(CACHE_MAGIC + CACHE_VERSION.to_bytes(1, byteorder='big'))
+        write_uint(stream, len(self.includes))
+        for path, digest in self.includes.items():
+            write_block(stream, path.encode('utf-8'))
+            write_block(stream, digest)
+        write_block(stream, self.program)
+        write_optional(stream, self.initial_data)
+        write_uint(stream, len(self.references))
+        for name, offset in self.references.items():
+            write_block(stream, name.encode('utf-8'))
+            write_uint(stream, offset)
+        write_optional(stream, json.dumps(self.stack_depths).encode('utf-8') if self.stack_depths is not None else None)
+        write_optional(stream, self.report.encode('utf-8') if self.report is not None else None)
+
+    @staticmethod
+    def load(stream):
+        header = read_exact(stream, len(CACHE_MAGIC) + 1)
+        if header != CACHE_MAGIC + CACHE_VERSION.to_bytes(1, byteorder='big'):
+            raise Exception('Not a cache entry')
+        includes = {}
+        for _ in range(read_uint(stream)):
+            path = read_block(stream).decode('utf-8')
+            includes[path] = read_block(stream)
+        program = read_block(stream)
+        initial_data = read_optional(stream)
+        references = {}
+        for _ in range(read_uint(stream)):
+            name = read_block(stream).decode('utf-8')
+            references[name] = read_uint(stream)
+        stack_depths = read_optional(stream)
+        report = read_optional(stream)
+        return CacheEntry(program, initial_data, references, json.loads(stack_depths) if stack_depths is not None else None, includes, report.decode('utf-8') if report is not None else None)
+
+# One entry per (options, assembler, every file the build read and its digest). The files a root pulls in are
+# only known after analysing it, so an index next to the entries lists the include sets seen for each root
+class BuildCache:
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path: str, options: dict, digests: dict[str, bytes]):
+        key = hashlib.sha256()
+        key.update(CACHE_MAGIC + CACHE_VERSION.to_bytes(1, byteorder='big'))
+        key.update(assembler_version().encode('ascii'))
+        key.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        key.update(path.encode('utf-8') + b'\0')
+        for include, digest in sorted(digests.items()):
+            key.update(include.encode('utf-8') + b'\0' + digest)
+        return key.hexdigest()
+
+    def entry_path(self, key: str):
+        return os.path.join(self.directory, key[:2], key + '.entry')
+
+    def index_path(self, path: str, options: dict, digest: bytes):
+        key = self.key(path, options, {path: digest})
+        return os.path.join(self.directory, key[:2], key + '.index')
+
+    def read_index(self, index_path: str):
+        try:
+            with open(index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def get(self, path: str, options: dict):
+        path = os.path.realpath(path)
+        digests = {}
+        try:
+            digests[path] = file_digest(path)
+        except Exception:
+            self.misses += 1
+            return None
+        for includes in self.read_index(self.index_path(path, options, digests[path])):
+            try:
+                for include in includes:
+                    if include not in digests:
+                        digests[include] = file_digest(include)
+                entry_path = self.entry_path(self.key(path, options, {include: digests[include] for include in includes}))
+                with open(entry_path, 'rb') as f:
+                    entry = CacheEntry.load(f)
+                os.utime(entry_path)
+                # The index is used whenever any of its entries is, so eviction reaches it last
+                os.utime(self.index_path(path, options, digests[path]))
+            except Exception:
+                continue
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, path: str, options: dict, entry: CacheEntry):
+        path = os.path.realpath(path)
+        write_atomic(self.entry_path(self.key(path, options, entry.includes)), entry.save)
+        index_path = self.index_path(path, options, entry.includes[path])
+        index = self.read_index(index_path)
+        includes = sorted(entry.includes)
+        if includes not in index:
+            index.append(includes)
+            write_atomic(index_path, lambda f: f.write(json.dumps(index).encode('utf-8')))
+        else:
+            os.utime(index_path)
+
+    # Entries and the indexes that find them, as (mtime, size, path)
+    def files(self):
+        files = []
+        if not os.path.isdir(self.directory):
+            return files
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(('.entry', '.index')):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return files
+
+    def entries(self):
+        return [file for file in self.files() if file[2].endswith('.entry')]
+
+    def size(self):
+        return sum(size for _, size, _ in self.files())
+
+    # Least recently used entries go first; hits touch their entry and its index, so an index outlives its entries
+    def evict(self, max_size: int | None = None):
+        max_size = self.max_size if max_size is None else max_size
+        files = sorted(self.files(), key=lambda file: (file[0], file[2].endswith('.index')))
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in files:
+            if total <= max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += path.endswith('.entry')
+        return removed
+
+def write_atomic(path: str, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+def cache_entry(sources: dict[str, Source], program: bytes, initial_data: bytes | None, references: dict[str, int], stack_depths: dict[str, int] | None, report: str | None = None):
+    return CacheEntry(program, initial_data, references, stack_depths, {path: text_digest(source.text) for path, source in sources.items()}, report)
@@ -0,0 +1,21 @@
+from buildcache import BuildCache, DEFAULT_MAX_SIZE
+import argparse
+import os
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument('command', choices=['stats', 'prune', 'clear'])
+parser.add_argument('--cache', default=os.environ.get('TFSM_CACHE'), help='cache directory (default $TFSM_CACHE)')
+parser.add_argument('--max-size', type=int, default=DEFAULT_MAX_SIZE, help='prune: bytes to keep, least recently used entries go first')
+args = parser.parse_args()
+
+if not args.cache:
+    sys.exit('no cache directory: pass --cache or set TFSM_CACHE')
+cache = BuildCache(args.cache, args.max_size)
+if args.command == 'stats':
+    entries = cache.entries()
+    print(f'{len(entries)} entries, {cache.size()} bytes in {args.cache}')
+elif args.command == 'prune':
+    print(f'removed {cache.evict()} entries, {cache.size()} bytes left')
+else:
+    print(f'removed {cache.evict(0)} entries')
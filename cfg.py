@@ -0,0 +1,74 @@
+from analyser import *
+
+JUMPS = ('JMP', 'RJMP')
+CONDITIONAL_JUMPS = ('JMT', 'JMF', 'RJMT', 'RJMF')
+TERMINATORS = ('RET', 'HALT')
+
+def decode_part(part):
+    if isinstance(part, RawInstruction):
+        return None, ()
+    if isinstance(part, ReferenceInstruction):
+        return MNEMONICS.get(part.prefix[0]), (part.reference.name,)
+    if isinstance(part, BytesInstruction) and len(part.bts) > 0:
+        name = MNEMONICS.get(part.bts[0])
+        if name is not None:
+            return name, INSTRUCTIONS[name].decode(memoryview(part.bts), 0)[0]
+    return None, ()
+
+# Nodes are indexes into Program.code; sections and includes fall through
+class ControlFlow:
+    def __init__(self, program: Program):
+        self.program = program
+        self.code = program.code
+        self.labels: dict[str, int] = {}
+        self.decoded: list[tuple[str | None, tuple]] = []
+        for i, part in enumerate(self.code):
+            if isinstance(part, Section):
+                self.labels[part.name] = i
+            self.decoded.append(decode_part(part) if isinstance(part, Instruction) else (None, ()))
+
+    def entries(self):
+        entries = {}
+        for name in ('internal', 'external', 'view'):
+            reference = getattr(self.program, name)
+            if reference is not None and reference.name in self.labels:
+                entries[name] = self.labels[reference.name]
+        return entries
+
+    def target(self, i: int):
+        return self.labels.get(self.decoded[i][1][0])
+
+    def successors(self, i: int):
+        name = self.decoded[i][0]
+        following = [i + 1] if i + 1 < len(self.code) else []
+        if name in TERMINATORS:
+            return []
+        if name in JUMPS:
+            target = self.target(i)
+            return [target] if target is not None else []
+        if name in CONDITIONAL_JUMPS or name == 'CALL':
+            target = self.target(i)
+            return ([target] if target is not None else []) + following
+        return following
+
+    def reachable(self, starts: list[int]):
+        seen = set(starts)
+        pending = list(starts)
+        while pending:
+            for successor in self.successors(pending.pop()):
+                if successor not in seen:
+                    seen.add(successor)
+                    pending.append(successor)
+        return seen
+
+    # (section name or None, start, end) for each run of code that starts at a label
+    def regions(self):
+        regions = []
+        start = 0
+        for i, part in enumerate(self.code):
+            if isinstance(part, Section) and i > start:
+                regions.append((self.code[start].name if isinstance(self.code[start], Section) else None, start, i))
+                start = i
+        if start < len(self.code):
+            regions.append((self.code[start].name if isinstance(self.code[start], Section) else None, start, len(self.code)))
+        return regions
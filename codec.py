@@ -0,0 +1,261 @@
+from array import array
+import re
+import struct
+
+U8 = 'u8'
+U64 = 'u64'
+BLOCK = 'block'
+
+FORMATS = {U8: 'B', U64: 'Q'}
+LENGTH = struct.Struct('>Q')
+SCHEMA_TOKEN = re.compile(r'\s*([(),:]|[^\s(),:]+)')
+
+# Same layout the contracts read with IREAD8/IREAD64/BREAD and write with the builder:
+# u8 is one byte, u64 is 8 bytes big endian, a block is a u64 length and the bytes
+class Schema:
+    def __init__(self, fields: list[tuple[str, 'str | Schema']]):
+        self.fields = fields
+        self.names = [name for name, _ in fields]
+        self.nested = any(isinstance(kind, Schema) for _, kind in fields)
+        self.kinds = self.flat_kinds()
+        # Each segment is a run of fixed-size fields plus the length of the block after it, packed by one Struct
+        self.segments: list[tuple[struct.Struct, int, int, bool]] = []
+        run = ''
+        start = 0
+        for i, kind in enumerate(self.kinds):
+            if kind != BLOCK:
+                run += FORMATS[kind]
+                continue
+            self.segments.append((struct.Struct('>' + run + 'Q'), start, i, True))
+            run = ''
+            start = i + 1
+        if run:
+            self.segments.append((struct.Struct('>' + run), start, len(self.kinds), False))
+        self.blocks = [i for i, kind in enumerate(self.kinds) if kind == BLOCK]
+        self.fixed_size = sum(segment.size for segment, _, _, _ in self.segments)
+        # Bound methods, looked up once rather than per record
+        self.packers = [(segment.pack_into, segment.size, start, stop, block) for segment, start, stop, block in self.segments]
+        self.unpackers = [(segment.unpack_from, segment.size, block) for segment, _, _, block in self.segments]
+
+    # "name:kind,..." with kinds u8, u64, block or a parenthesized record; names are optional
+    @staticmethod
+    def parse(text: str):
+        tokens = SCHEMA_TOKEN.findall(text)
+        schema, end = parse_fields(tokens, 0)
+        if end != len(tokens):
+            raise Exception(f'Unexpected {tokens[end]!r} in schema {text!r}')
+        return schema
+
+    def flat_kinds(self):
+        kinds = []
+        for _, kind in self.fields:
+            if isinstance(kind, Schema):
+                kinds.extend(kind.flat_kinds())
+            else:
+                kinds.append(kind)
+        return kinds
+
+    def flatten(self, values, out: list):
+        if len(values) != len(self.fields):
+            raise Exception(f'Expected {len(self.fields)} values, got {len(values)}')
+        for (_, kind), value in zip(self.fields, values):
+            if isinstance(kind, Schema):
+                kind.flatten(value, out)
+            else:
+                out.append(value)
+        return out
+
+    def nest(self, flat, position: int = 0):
+        values = []
+        for _, kind in self.fields:
+            if isinstance(kind, Schema):
+                value, position = kind.nest(flat, position)
+                values.append(value)
+            else:
+                values.append(flat[position])
+                position += 1
+        return tuple(values), position
+
+    def flat(self, values):
+        return self.flatten(values, []) if self.nested else values
+
+    def size(self, values):
+        return self.flat_size(self.flat(values))
+
+    def flat_size(self, flat):
+        if len(flat) != len(self.kinds):
+            raise IndexError
+        size = self.fixed_size
+        for i in self.blocks:
+            size += len(flat[i])
+        return size
+
+    # Writes one record at offset into a writable memoryview and returns where it ends
+    def pack_into(self, view: memoryview, offset: int, flat):
+        for pack_into, size, start, stop, block in self.packers:
+            if block:
+                value = flat[stop]
+                pack_into(view, offset, *flat[start:stop], len(value))
+                offset += size
+                end = offset + len(value)
+                view[offset:end] = value
+                offset = end
+            else:
+                pack_into(view, offset, *flat[start:stop])
+                offset += size
+        return offset
+
+    # A single record is cheaper to join from packed parts than to size and copy out of a buffer
+    def encode(self, values):
+        flat = self.flat(values)
+        try:
+            if len(flat) != len(self.kinds):
+                raise IndexError
+            parts = []
+            for segment, start, stop, block in self.segments:
+                if block:
+                    value = flat[stop]
+                    parts.append(segment.pack(*flat[start:stop], len(value)))
+                    parts.append(value)
+                else:
+                    parts.append(segment.pack(*flat[start:stop]))
+            return b''.join(parts)
+        except (struct.error, TypeError, IndexError) as e:
+            raise self.encode_error(flat, e)
+
+    # One buffer for the whole batch, sized before anything is packed; record i is buffer[offsets[i]:offsets[i + 1]]
+    def encode_batch(self, records: list):
+        flats = [self.flat(values) for values in records] if self.nested else records
+        offsets = array('Q', [0])
+        total = 0
+        for i, flat in enumerate(flats):
+            try:
+                total += self.flat_size(flat)
+            except (TypeError, IndexError) as e:
+                raise Exception(f'Record {i}: {self.encode_error(flat, e)}')
+            offsets.append(total)
+        buffer = bytearray(total)
+        with memoryview(buffer) as view:
+            offset = 0
+            for i, flat in enumerate(flats):
+                try:
+                    offset = self.pack_into(view, offset, flat)
+                except (struct.error, TypeError, IndexError, ValueError) as e:
+                    raise Exception(f'Record {i}: {self.encode_error(flat, e)}')
+        return buffer, offsets
+
+    def encode_error(self, flat, error: Exception):
+        if len(flat) != len(self.kinds):
+            return Exception(f'Expected {len(self.kinds)} values, got {len(flat)}')
+        for i, (kind, value) in enumerate(zip(self.kinds, flat)):
+            if kind == BLOCK and not isinstance(value, (bytes, bytearray, memoryview)):
+                return Exception(f'Cannot encode value {i}: expected bytes for a block, got {type(value).__name__}')
+            if kind != BLOCK and (not isinstance(value, int) or not 0 <= value < 1 << 8 * struct.calcsize(FORMATS[kind])):
+                return Exception(f'Cannot encode value {i}: {value!r} is not a {kind}')
+        return Exception(f'Cannot encode record: {error}')
+
+    def unpack_from(self, view: memoryview, offset: int):
+        flat = ()
+        for unpack_from, size, block in self.unpackers:
+            values = unpack_from(view, offset)
+            offset += size
+            if block:
+                end = offset + values[-1]
+                if end > len(view):
+                    raise Exception(f'Truncated record: block at {offset} needs {end - len(view)} more bytes')
+                flat += values[:-1] + (view[offset:end],)
+                offset = end
+            else:
+                flat += values
+        return flat, offset
+
+    # Blocks come back as memoryview slices of data, nothing is copied
+    def decode(self, data, offset: int = 0):
+        view = data if isinstance(data, memoryview) else memoryview(data)
+        try:
+            flat, offset = self.unpack_from(view, offset)
+        except struct.error:
+            raise Exception(f'Truncated record at {offset}')
+        if self.nested:
+            return self.nest(flat)[0], offset
+        return flat, offset
+
+    # With offsets every record must end exactly where the next one starts
+    def decode_batch(self, data, offsets: array | None = None):
+        view = data if isinstance(data, memoryview) else memoryview(data)
+        records = []
+        offset = 0
+        try:
+            if offsets is not None:
+                for i in range(len(offsets) - 1):
+                    flat, end = self.unpack_from(view, offsets[i])
+                    if end != offsets[i + 1]:
+                        raise Exception(f'Record {i} ends at {end}, but the next record starts at {offsets[i + 1]}')
+                    records.append(flat)
+            else:
+                while offset < len(view):
+                    flat, offset = self.unpack_from(view, offset)
+                    records.append(flat)
+        except struct.error:
+            raise Exception(f'Truncated record {len(records)} in batch')
+        if self.nested:
+            return [self.nest(flat)[0] for flat in records]
+        return records
+
+    # JSON carries blocks as hex strings and records as arrays
+    def from_json(self, values: list):
+        if len(values) != len(self.fields):
+            raise Exception(f'Expected {len(self.fields)} values, got {len(values)}')
+        result = []
+        for (_, kind), value in zip(self.fields, values):
+            if isinstance(kind, Schema):
+                result.append(kind.from_json(value))
+            elif kind == BLOCK:
+                result.append(bytes.fromhex(value))
+            else:
+                result.append(int(value))
+        return tuple(result)
+
+    def to_json(self, values):
+        result = {}
+        for (name, kind), value in zip(self.fields, values):
+            if isinstance(kind, Schema):
+                result[name] = kind.to_json(value)
+            elif kind == BLOCK:
+                result[name] = value.hex()
+            else:
+                result[name] = value
+        return result
+
+def parse_fields(tokens: list[str], position: int):
+    fields = []
+    while True:
+        name = f'field{len(fields)}'
+        if position + 1 < len(tokens) and tokens[position + 1] == ':':
+            name = tokens[position]
+            position += 2
+        if position >= len(tokens):
+            raise Exception('Schema ends where a field type was expected')
+        if tokens[position] == '(':
+            kind, position = parse_fields(tokens, position + 1)
+            if position >= len(tokens) or tokens[position] != ')':
+                raise Exception('Missing ) in schema')
+        elif tokens[position] in (U8, U64, BLOCK):
+            kind = tokens[position]
+        else:
+            raise Exception(f'Unknown field type {tokens[position]!r} in schema')
+        fields.append((name, kind))
+        position += 1
+        if position >= len(tokens) or tokens[position] != ',':
+            return Schema(fields), position
+        position += 1
+
+MESSAGE_SCHEMA = Schema([
+    ('type', U8),
+    ('sender', BLOCK),
+    ('receiver', BLOCK),
+    ('init', BLOCK),
+    ('opcode', U64),
+    ('data', BLOCK),
+    ('timestamp', U64),
+])
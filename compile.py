@@ -1,19 +1,100 @@
-from tokenizer import Tokenizer
+from tokenizer import tokenize_file
 from analyser import Analyser
-from compiler import Compiler
-import hashlib 
-
+from compiler import Compiler, print_executive, write_executive
+from assembler import Options, assemble_batch, assemble_file, expand_sources
+from optimizer import INLINE_LEVELS
+from buildcache import BuildCache, DEFAULT_MAX_SIZE
+from watcher import Watcher
+import argparse
+import json
+import os
 import sys
 
-with open(sys.argv[-1], encoding='utf-8') as f:
-    tokenizer = Tokenizer(f.read())
-    tokenizer.parse()
-    analyser = Analyser(tokenizer.tokens)
+def inline_limit(value: str):
+    if value in INLINE_LEVELS:
+        return INLINE_LEVELS[value]
+    return int(value)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('sources', nargs='+', help='source files, directories or globs')
+parser.add_argument('-o', '--output', help='write the raw binary executive (or object with -c) to this file')
+parser.add_argument('-c', '--object', action='store_true', help='compile to a relocatable object without expanding includes')
+parser.add_argument('-O', '--optimize', action='store_true', help='run the peephole optimizer and print its statistics')
+parser.add_argument('-i', '--inline', type=inline_limit, help='inline small and single-use subroutines: size, speed, or the bytes of growth allowed per subroutine; implies the peephole pass')
+parser.add_argument('-d', '--dead-code', action='store_true', help='drop sections unreachable from the entry points and print what was removed')
+parser.add_argument('-r', '--relax', action='store_true', help='let the compiler shorten JMP/JMT/JMF to relative jumps where they fit')
+parser.add_argument('-s', '--stack', action='store_true', help='check stack depths statically and print the maximum per entry point')
+parser.add_argument('-w', '--watch', action='store_true', help='keep running and relink the contracts whenever one of their files changes')
+parser.add_argument('-g', '--source-map', help='write a map from code offsets to file, line and section to this file')
+parser.add_argument('-m', '--manifest', help='batch mode: write one JSON line per contract to this file (- for stdout)')
+parser.add_argument('-j', '--jobs', type=int, help='batch mode: number of worker processes')
+parser.add_argument('--cache', help='reuse executives built from unchanged sources, stored in this directory (default $TFSM_CACHE)')
+parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE, help='bytes the cache may hold before least recently used entries are evicted')
+args = parser.parse_args()
+options = Options(optimize=args.optimize, relax=args.relax, dead_code=args.dead_code, check_stack=args.stack, inline=args.inline)
+cache_dir = args.cache or os.environ.get('TFSM_CACHE')
+cache = BuildCache(cache_dir, args.cache_size) if cache_dir else None
+
+sources = expand_sources(args.sources)
+if args.watch:
+    # The watcher relinks per-file objects and only prints, whole-program passes, outputs and the executive cache do not apply
+    if args.optimize or args.inline is not None or args.dead_code or args.stack or args.relax or args.cache is not None:
+        parser.error('-w/--watch cannot be combined with -O, -i, -d, -s, -r or --cache')
+    if args.object or args.output is not None or args.source_map is not None or args.manifest is not None or args.jobs is not None:
+        parser.error('-w/--watch cannot be combined with -c, -o, -g, -m or -j')
+    try:
+        for line in Watcher(sources).watch():
+            print(line, flush=True)
+    except KeyboardInterrupt:
+        sys.exit()
+if args.manifest is not None or len(sources) != 1 or sources != args.sources:
+    if args.source_map is not None:
+        sys.exit('--source-map takes a single source')
+    if args.object or args.output is not None:
+        parser.error('-c/--object and -o/--output take a single source, batch mode writes a manifest')
+    manifest = sys.stdout if args.manifest in (None, '-') else open(args.manifest, 'w', encoding='utf-8')
+    failed = 0
+    for record in assemble_batch(sources, args.jobs, options, cache):
+        if 'error' in record:
+            failed += 1
+            print(f'{record["source"]}: {record["error"]}', file=sys.stderr)
+        manifest.write(json.dumps(record) + '\n')
+    if manifest is not sys.stdout:
+        manifest.close()
+    if cache is not None:
+        cache.evict()
+    print(f'{len(sources) - failed}/{len(sources)} compiled', file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+source = sources[0]
+if args.object:
+    # Objects keep every branch long, relaxing needs the final layout
+    if args.relax:
+        parser.error('-r/--relax needs the whole program, link the objects without it or compile without -c')
+    if args.optimize or args.inline is not None or args.dead_code or args.stack or args.source_map is not None:
+        parser.error('-c/--object cannot be combined with -O, -i, -d, -s or -g, they need the whole program')
+    analyser = Analyser(tokenize_file(source), source, follow_includes=False)
     analyser.analys()
-    compiler = Compiler(analyser.program)
-    program = compiler.compile()
-    print('program: ' + program.hex())
-    if analyser.program.initial_data is not None:
-        executive = len(program).to_bytes(8, byteorder='big') + program + len(analyser.program.initial_data.bt).to_bytes(8, byteorder='big') + analyser.program.initial_data.bt
-        print('executive: ' + executive.hex())
-        print('address: ' + hashlib.sha256(executive).digest().hex())
\ No newline at end of file
+    obj = Compiler(analyser.program).compile_object(os.path.realpath(source))
+    output = args.output if args.output is not None else os.path.splitext(source)[0] + '.tfo'
+    with open(output, 'wb') as f:
+        obj.save(f)
+    sys.exit()
+assembly = assemble_file(source, options, cache, source_map=args.source_map is not None)
+if cache is not None:
+    cache.evict()
+if assembly.report is not None:
+    print(assembly.report, file=sys.stderr)
+if assembly.stack_depths is not None:
+    print('stack: ' + ' '.join(f'{entry}={depth}' for entry, depth in assembly.stack_depths.items()), file=sys.stderr)
+if assembly.source_map is not None:
+    with open(args.source_map, 'wb') as f:
+        assembly.source_map.save(f)
+if args.output is not None:
+    if assembly.initial_data is None:
+        sys.exit('executive needs .data')
+    with open(args.output, 'wb') as output:
+        address = write_executive(output, assembly.program, assembly.initial_data)
+    print('address: ' + address.hex())
+else:
+    print_executive(assembly.program, assembly.initial_data)
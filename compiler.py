@@ -1,38 +1,200 @@
 from analyser import *
+from objectfile import *
+from sourcemap import *
+import hashlib
+import sys
 
 class Compiler:
-    def __init__(self, program: Program):
+    def __init__(self, program: Program, relax: bool = False):
         self.program = program
-        self.code = bytes()
+        self.relax = relax
+        # The code starts this far into the program compile() returns
+        self.header_size = 0
         self.references: dict[str, int] = {}
+        self.size = 0
 
-    def calculate_references(self):
+    def relaxable(self):
+        if self.relax:
+            for i, part in enumerate(self.program.code):
+                if isinstance(part, ReferenceInstruction) and not isinstance(part, BranchInstruction):
+                    name = MNEMONICS[part.prefix[0]]
+                    for branch, (absolute, _) in BRANCHES.items():
+                        if name == absolute:
+                            self.program.code[i] = INSTRUCTIONS[branch].build(part.reference)
+                            self.program.code[i].location = part.location
+        return [part for part in self.program.code if isinstance(part, BranchInstruction)]
+
+    def layout(self):
+        offsets = []
         bts = 0
         for part in self.program.code:
+            if isinstance(part, BranchInstruction):
+                offsets.append(bts)
             if isinstance(part, Instruction):
                 bts += len(part)
             if isinstance(part, Section):
                 self.references[part.name] = bts
+        self.size = bts
+        return offsets
+
+    # Branches start short and only ever grow, so this reaches a fixpoint
+    def calculate_references(self):
+        branches = self.relaxable()
+        for branch in branches:
+            branch.relative = True
+        while True:
+            offsets = self.layout()
+            grown = False
+            for branch, offset in zip(branches, offsets):
+                if not branch.relative or branch.reference.name not in self.references:
+                    continue
+                if not branch.reaches(CompilerState(self.references, offset)):
+                    branch.relative = False
+                    grown = True
+            if not grown:
+                break
+
+    def header(self):
+        entries = [entry.name if entry is not None else None for entry in (self.program.internal, self.program.external, self.program.view)]
+        return build_header(self.references, entries)
 
     def compile(self):
         self.calculate_references()
+        header = self.header()
+        program = bytearray(len(header) + self.size)
+        view = memoryview(program)
+        view[:len(header)] = header
+        code = view[len(header):]
+        state = CompilerState(self.references, 0)
         for part in self.program.code:
             if isinstance(part, Instruction):
-                self.code += part.compile(state=CompilerState(self.references, len(self.code)))
-                pass
-        program = bytes()
-        if self.program.internal is not None:
-            program += b'\1' + self.references[self.program.internal.name].to_bytes(UINT64_SIZE, byteorder='big')
-        else:
-            program += b'\0'
-        if self.program.external is not None:
-            program += b'\1' + self.references[self.program.external.name].to_bytes(UINT64_SIZE, byteorder='big')
+                part.write(code, state)
+                state.current += len(part)
+        # An open export would stop callers from resizing the program
+        code.release()
+        view.release()
+        self.header_size = len(header)
+        return program
+
+    # Call after compile(), offsets are into the code that follows the header
+    def source_map(self):
+        source_map = SourceMap()
+        offset = 0
+        for part in self.program.code:
+            if isinstance(part, Section):
+                source_map.add_section(part.name, offset)
+            elif isinstance(part, Instruction):
+                if part.location is not None:
+                    source, character = part.location
+                    source_map.add(offset, source.path or '<source>', source.location(character)[0])
+                offset += len(part)
+        source_map.size = offset
+        return source_map
+
+    def compile_object(self, source: str):
+        obj = ObjectFile(source)
+        for entry in ('internal', 'external', 'view'):
+            reference = getattr(self.program, entry)
+            setattr(obj, entry, reference.name if reference is not None else None)
+        if self.program.initial_data is not None:
+            obj.initial_data = self.program.initial_data.bt
+        for name, position in self.program.positions.items():
+            obj.positions[name] = sum(isinstance(part, Include) for part in self.program.code[:position])
+        parts = []
+        for part in self.program.code + [None]:
+            if isinstance(part, Include) or part is None:
+                obj.chunks.append(self.compile_chunk(parts))
+                if part is not None:
+                    obj.includes.append(part.path)
+                parts = []
+            else:
+                parts.append(part)
+        return obj
+
+    def compile_chunk(self, parts: list[Instruction | Section]):
+        sections = {}
+        size = 0
+        for part in parts:
+            if isinstance(part, BranchInstruction):
+                part.relative = False
+            if isinstance(part, Instruction):
+                size += len(part)
+            if isinstance(part, Section):
+                sections[part.name] = size
+        code = bytearray(size)
+        view = memoryview(code)
+        relocations = []
+        state = CompilerState(sections, 0)
+        for part in parts:
+            if isinstance(part, ReferenceInstruction):
+                relocations.append(Relocation(state.current, part.prefix, part.reference.name, part.relative))
+                view[state.current:state.current + len(part.prefix)] = part.prefix
+                state.current += len(part)
+            elif isinstance(part, Instruction):
+                part.write(view, state)
+                state.current += len(part)
+        return Chunk(bytes(code), sections, relocations)
+
+def build_header(references: dict[str, int], entries: list[str | None]):
+    header = bytes()
+    for entry in entries:
+        if entry is not None:
+            header += b'\1' + references[entry].to_bytes(UINT64_SIZE, byteorder='big')
         else:
-            program += b'\0'
-        if self.program.view is not None:
-            program += b'\1' + self.references[self.program.view.name].to_bytes(UINT64_SIZE, byteorder='big')
+            header += b'\0'
+    return header
+
+def parse_header(program: memoryview):
+    entries: list[int | None] = []
+    offset = 0
+    for _ in range(3):
+        if offset >= len(program):
+            raise Exception('Truncated program header')
+        if program[offset] == 0:
+            entries.append(None)
+            offset += 1
         else:
-            program += b'\0'
-        program += self.code
-        return program
-        
+            entries.append(int.from_bytes(program[offset + 1:offset + 1 + UINT64_SIZE], byteorder='big'))
+            offset += 1 + UINT64_SIZE
+    if offset > len(program):
+        raise Exception('Truncated program header')
+    return entries, offset
+
+def parse_executive(executive: memoryview):
+    program_size = int.from_bytes(executive[:UINT64_SIZE], byteorder='big')
+    program = executive[UINT64_SIZE:UINT64_SIZE + program_size]
+    start = UINT64_SIZE + program_size
+    data_size = int.from_bytes(executive[start:start + UINT64_SIZE], byteorder='big')
+    initial_data = executive[start + UINT64_SIZE:start + UINT64_SIZE + data_size]
+    if len(program) != program_size or len(initial_data) != data_size:
+        raise Exception('Truncated executive')
+    return program, initial_data
+
+def executive_parts(program: bytes, initial_data: bytes):
+    return (
+        len(program).to_bytes(UINT64_SIZE, byteorder='big'),
+        program,
+        len(initial_data).to_bytes(UINT64_SIZE, byteorder='big'),
+        initial_data,
+    )
+
+def build_executive(program: bytes, initial_data: bytes):
+    return b''.join(executive_parts(program, initial_data))
+
+def write_executive(stream, program: bytes, initial_data: bytes):
+    digest = hashlib.sha256()
+    for part in executive_parts(program, initial_data):
+        stream.write(part)
+        digest.update(part)
+    return digest.digest()
+
+def print_executive(program: bytes, initial_data: bytes | None):
+    print('program: ' + program.hex())
+    if initial_data is not None:
+        digest = hashlib.sha256()
+        sys.stdout.write('executive: ')
+        for part in executive_parts(program, initial_data):
+            sys.stdout.write(part.hex())
+            digest.update(part)
+        print()
+        print('address: ' + digest.digest().hex())
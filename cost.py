@@ -0,0 +1,52 @@
+from assembler import Options, assemble_file
+from disassembler import map_file, split_image
+from estimator import CostEstimator, CostTable, METRICS
+from sourcemap import SourceMap
+import argparse
+import json
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument('input', help='a .tfsm source, or an executive or program binary or hex dump (- for stdin)')
+parser.add_argument('-t', '--table', help='JSON cost table: {"default": 1, "opcodes": {"BHASH": 20}, "byte": 0, "max_block": 1024}')
+parser.add_argument('-g', '--source-map', help='source map for a binary input, for section names in the report')
+parser.add_argument('-O', '--optimize', action='store_true', help='with a .tfsm source, estimate the peephole-optimized code')
+parser.add_argument('-r', '--relax', action='store_true', help='with a .tfsm source, estimate the relaxed code')
+parser.add_argument('--budget', type=int, help='fail if an entry can cost more than this, or has a loop without a bound')
+parser.add_argument('--byte-budget', type=int, help='fail if an entry can push or write more bytes than this')
+parser.add_argument('--json', action='store_true', help='print the bounds as JSON instead of a report')
+args = parser.parse_args()
+
+table = CostTable()
+if args.table is not None:
+    with open(args.table, encoding='utf-8') as f:
+        table = CostTable.load(f)
+source_map = None
+if args.input.endswith('.tfsm'):
+    assembly = assemble_file(args.input, Options(optimize=args.optimize, relax=args.relax), source_map=True)
+    program = memoryview(assembly.program)
+    source_map = assembly.source_map
+else:
+    image = memoryview(sys.stdin.buffer.read()) if args.input == '-' else map_file(args.input)
+    program, _ = split_image(image)
+    if args.source_map is not None:
+        with open(args.source_map, 'rb') as f:
+            source_map = SourceMap.load(f)
+
+estimator = CostEstimator(program, table, source_map)
+summaries = estimator.estimate()
+if args.json:
+    print(json.dumps({name: dict(zip(METRICS, summary.worst()), unbounded=summary.unbounded) for name, summary in summaries.items()}))
+else:
+    print(estimator.report(summaries))
+
+failed = False
+for name, summary in summaries.items():
+    steps, cost, size = summary.worst()
+    if args.budget is not None and (summary.unbounded or cost > args.budget):
+        print(f'.{name}: cost {cost}{" and unbounded" if summary.unbounded else ""}, budget {args.budget}', file=sys.stderr)
+        failed = True
+    if args.byte_budget is not None and (summary.unbounded or size > args.byte_budget):
+        print(f'.{name}: {size} bytes{" and unbounded" if summary.unbounded else ""}, budget {args.byte_budget}', file=sys.stderr)
+        failed = True
+sys.exit(1 if failed else 0)
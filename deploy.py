@@ -1,31 +1,44 @@
-from tokenizer import Tokenizer
-from analyser import Analyser
-from compiler import Compiler
-import hashlib 
-import requests
-
+from deployer import Deployer, Record, read_records, schema_records
+from codec import Schema
+import argparse
+import asyncio
+import json
 import sys
 
-with open(sys.argv[-1], encoding='utf-8') as f:
-    tokenizer = Tokenizer(f.read())
-    tokenizer.parse()
-    analyser = Analyser(tokenizer.tokens)
-    analyser.analys()
-    compiler = Compiler(analyser.program)
-    program = compiler.compile()
-    if analyser.program.initial_data is not None:
-        executive = len(program).to_bytes(8, byteorder='big') + program + len(analyser.program.initial_data.bt).to_bytes(8, byteorder='big') + analyser.program.initial_data.bt
-        receiver = 'abcdef'
-        message = 'hello'
-        data = {
-            "type": "external",
-            "receiver": hashlib.sha256(executive).digest().hex(),
-            "init": {
-                "program": program.hex(),
-                "data": analyser.program.initial_data.bt.hex()
-            },
-            "opcode": 0,
-            "body": (len(receiver).to_bytes(8, byteorder='big') + receiver.encode('utf-8') + len(message).to_bytes(8, byteorder='big') + message.encode('utf-8')).hex()
-        }
-        response = requests.post('http://localhost:8080/message/send', json=data)
-        print('Message sent successfully:', response.json())
\ No newline at end of file
+parser = argparse.ArgumentParser()
+parser.add_argument('source', help='a .tfsm contract, or a JSON-lines file of {"contract", "opcode", "body"} records (- for stdin)')
+parser.add_argument('--url', default='http://localhost:8080')
+parser.add_argument('-c', '--concurrency', type=int, default=16)
+parser.add_argument('--retries', type=int, default=3)
+parser.add_argument('--timeout', type=float, default=10.0)
+parser.add_argument('--opcode', type=int, default=0, help='with a .tfsm source')
+parser.add_argument('--body', default='', help='hex, with a .tfsm source')
+parser.add_argument('--schema', help='body layout such as "amount:u64,to:block", with a .tfsm source and --fields')
+parser.add_argument('--fields', help='JSON-lines file of field arrays, one message each, encoded with --schema')
+args = parser.parse_args()
+if (args.schema is None) != (args.fields is None):
+    parser.error('--schema and --fields go together')
+schema = None
+if args.schema is not None:
+    try:
+        schema = Schema.parse(args.schema)
+    except Exception as e:
+        parser.error(f'--schema: {e}')
+
+deployer = Deployer(args.url, args.concurrency, args.retries, timeout=args.timeout)
+if args.source.endswith('.tfsm'):
+    if schema is not None:
+        with open(args.fields, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        records = schema_records(args.source, args.opcode, schema, rows)
+    else:
+        records = [Record(args.source, args.opcode, bytes.fromhex(args.body))]
+    asyncio.run(deployer.run(records, keep_responses=True))
+    for response in deployer.responses:
+        print('Message sent successfully:', response.json())
+else:
+    stream = sys.stdin if args.source == '-' else open(args.source, encoding='utf-8')
+    with stream:
+        asyncio.run(deployer.run(read_records(stream)))
+print(deployer.report(), file=sys.stderr)
+sys.exit(1 if deployer.failures else 0)
@@ -0,0 +1,154 @@
+from assembler import Assembly, assemble_file
+from codec import Schema
+from transport import HttpError, HttpPool, RequestSentError
+import asyncio
+import functools
+import json
+import math
+import random
+import time
+
+SEND_PATH = '/message/send'
+# Sending is not idempotent, so only answers saying the node did not run the message are retried
+RETRY_STATUSES = (429, 503)
+
+class Record:
+    def __init__(self, contract: str, opcode: int, body: bytes, type: str = 'external', init: bool = True, error: Exception | None = None):
+        self.contract = contract
+        self.opcode = opcode
+        self.body = body
+        self.type = type
+        self.init = init
+        # Set when the record could not be read, so it is reported as a failure instead of sent
+        self.error = error
+
+    # The body is hex, or "schema" and "fields" to have the codec encode it
+    @staticmethod
+    def from_json(record: dict):
+        if 'schema' in record:
+            schema = parse_schema(record['schema'])
+            body = schema.encode(schema.from_json(record.get('fields', [])))
+        else:
+            body = bytes.fromhex(record.get('body', ''))
+        return Record(record['contract'], record.get('opcode', 0), body, record.get('type', 'external'), record.get('init', True))
+
+@functools.cache
+def parse_schema(text: str):
+    return Schema.parse(text)
+
+# Encodes every body in one batch; records hold views into the shared buffer
+def schema_records(contract: str, opcode: int, schema: Schema, rows: list):
+    buffer, offsets = schema.encode_batch([schema.from_json(row) for row in rows])
+    view = memoryview(buffer)
+    return [Record(contract, opcode, view[start:end]) for start, end in zip(offsets, offsets[1:])]
+
+def read_records(stream):
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield Record.from_json(json.loads(line))
+            except Exception as e:
+                yield Record(f'<line {number}>', 0, b'', error=e)
+
+def percentile(values: list[float], q: float):
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+class Deployer:
+    def __init__(self, url: str, concurrency: int = 16, retries: int = 3, backoff: float = 0.1, timeout: float = 10.0):
+        self.url = url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.pool: HttpPool | None = None
+        self.assemblies: dict[str, Assembly] = {}
+        self.latencies: list[float] = []
+        self.failures: list[tuple[Record, Exception]] = []
+        self.responses: list = []
+        self.retried = 0
+        self.elapsed = 0.0
+
+    def assembly(self, contract: str):
+        if contract not in self.assemblies:
+            assembly = assemble_file(contract)
+            if assembly.executive is None:
+                raise Exception(f'{contract} has no .data, cannot build an executive')
+            self.assemblies[contract] = assembly
+        return self.assemblies[contract]
+
+    def payload(self, record: Record):
+        if record.error is not None:
+            raise record.error
+        assembly = self.assembly(record.contract)
+        payload = {
+            'type': record.type,
+            'receiver': assembly.address.hex(),
+            'opcode': record.opcode,
+            'body': record.body.hex(),
+        }
+        if record.init:
+            payload['init'] = {
+                'program': assembly.program.hex(),
+                'data': assembly.initial_data.hex(),
+            }
+        return payload
+
+    async def send(self, record: Record):
+        try:
+            payload = self.payload(record)
+        except Exception as e:
+            self.failures.append((record, e))
+            return None
+        start = time.perf_counter()
+        error: Exception | None = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.pool.post_json(SEND_PATH, payload)
+            except RequestSentError as e:
+                error = e
+                break
+            except (OSError, asyncio.TimeoutError, HttpError) as e:
+                error = e
+            else:
+                if response.status < 400:
+                    self.latencies.append(time.perf_counter() - start)
+                    return response
+                error = HttpError(f'HTTP {response.status}: {response.body[:200]!r}')
+                if response.status not in RETRY_STATUSES:
+                    break
+            if attempt < self.retries:
+                self.retried += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+        self.failures.append((record, error))
+        return None
+
+    async def worker(self, records, keep_responses: bool):
+        for record in records:
+            response = await self.send(record)
+            if keep_responses and response is not None:
+                self.responses.append(response)
+
+    async def run(self, records, keep_responses: bool = False):
+        self.pool = HttpPool(self.url, self.concurrency, self.timeout)
+        records = iter(records)
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*[self.worker(records, keep_responses) for _ in range(self.concurrency)])
+        finally:
+            self.elapsed = time.perf_counter() - start
+            await self.pool.close()
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        total = len(latencies) + len(self.failures)
+        lines = [
+            f'sent: {len(latencies)}/{total} ({len(self.failures)} failed, {self.retried} retries)',
+            f'elapsed: {self.elapsed:.3f} s',
+            f'throughput: {len(latencies) / self.elapsed if self.elapsed else 0.0:.1f} msg/s',
+            'latency ms: ' + ' '.join(f'p{int(q * 100)}={1000 * percentile(latencies, q):.2f}' for q in (0.5, 0.9, 0.99)) + f' max={1000 * (latencies[-1] if latencies else 0.0):.2f}',
+        ]
+        for record, error in self.failures[:10]:
+            lines.append(f'failed: {record.contract} opcode={record.opcode}: {type(error).__name__}: {error}')
+        return '\n'.join(lines)
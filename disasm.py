@@ -0,0 +1,35 @@
+from disassembler import Disassembler, map_file, reassemble, split_image
+from sourcemap import SourceMap
+import argparse
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument('input', help='executive or program binary, or a hex dump of one (- for stdin)')
+parser.add_argument('-o', '--output', help='write the source to this file instead of stdout')
+framing = parser.add_mutually_exclusive_group()
+framing.add_argument('--executive', dest='executive', action='store_const', const=True, help='input is length-prefixed program and data')
+framing.add_argument('--program', dest='executive', action='store_const', const=False, help='input is a bare program (header and code)')
+parser.add_argument('-g', '--source-map', help='source map from compile.py -g, for section names and file:line comments')
+parser.add_argument('--verify', action='store_true', help='reassemble the output and fail unless it matches the input byte for byte')
+args = parser.parse_args()
+
+image = memoryview(sys.stdin.buffer.read()) if args.input == '-' else map_file(args.input)
+program, initial_data = split_image(image, args.executive)
+source_map = None
+if args.source_map is not None:
+    with open(args.source_map, 'rb') as f:
+        source_map = SourceMap.load(f)
+disassembler = Disassembler(program, initial_data, source_map)
+output = sys.stdout if args.output is None else open(args.output, 'w', encoding='utf-8')
+lines = []
+for line in disassembler.lines():
+    output.write(line + '\n')
+    if args.verify:
+        lines.append(line)
+if output is not sys.stdout:
+    output.close()
+if args.verify:
+    reassembled, data = reassemble('\n'.join(lines))
+    if reassembled != program or (initial_data is not None and data != initial_data):
+        sys.exit('verify: reassembled bytes differ from the input')
+    print(f'verify: {len(program)} program bytes reassemble identically', file=sys.stderr)
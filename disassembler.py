@@ -0,0 +1,188 @@
+from compiler import *
+import bisect
+import mmap
+
+ENTRY_NAMES = ('internal', 'external', 'view')
+RAW_LINE = 32
+PRINTABLE = frozenset(range(0x20, 0x7f)) | {0x09, 0x0a, 0x0d}
+
+def map_file(path: str):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def is_text(image: memoryview):
+    return len(image) > 0 and all(byte in PRINTABLE for byte in image[:256])
+
+# Hex dumps come either bare or as the "executive: ..." / "program: ..." lines compile.py prints
+def parse_dump(text: str):
+    fields = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(':')
+        if sep and key.strip() in ('executive', 'program'):
+            fields[key.strip()] = value.strip()
+    if 'executive' in fields:
+        return memoryview(bytes.fromhex(fields['executive'])), True
+    if 'program' in fields:
+        return memoryview(bytes.fromhex(fields['program'])), False
+    text = ''.join(text.split())
+    if text.startswith('0x'):
+        text = text[2:]
+    return memoryview(bytes.fromhex(text)), None
+
+def is_executive(image: memoryview):
+    if len(image) < 2 * UINT64_SIZE:
+        return False
+    program_size = int.from_bytes(image[:UINT64_SIZE], byteorder='big')
+    start = UINT64_SIZE + program_size
+    if start + UINT64_SIZE > len(image):
+        return False
+    data_size = int.from_bytes(image[start:start + UINT64_SIZE], byteorder='big')
+    return start + UINT64_SIZE + data_size == len(image)
+
+# (program, initial data or None); executive is None to detect the framing
+def split_image(image: memoryview, executive: bool | None = None):
+    if is_text(image):
+        image, framed = parse_dump(bytes(image).decode('ascii'))
+        executive = framed if executive is None else executive
+    if executive is None:
+        executive = is_executive(image)
+    if executive:
+        return parse_executive(image)
+    return image, None
+
+class Disassembler:
+    def __init__(self, program: memoryview, initial_data: memoryview | None = None, source_map: SourceMap | None = None):
+        self.entries, header_size = parse_header(program)
+        expected = b''.join(b'\0' if entry is None else b'\1' + entry.to_bytes(UINT64_SIZE, byteorder='big') for entry in self.entries)
+        if program[:header_size] != expected:
+            raise Exception('Header flags other than 0 and 1 cannot be reassembled')
+        self.code = program[header_size:]
+        self.initial_data = initial_data
+        self.source_map = source_map
+        self.labels: dict[int, str] = {}
+        self.raw: set[int] = set()
+        if source_map is not None:
+            for name, offset in zip(source_map.section_names, source_map.section_offsets):
+                if offset <= len(self.code):
+                    self.labels.setdefault(offset, name)
+        for name, entry in zip(ENTRY_NAMES, self.entries):
+            if entry is not None:
+                if entry > len(self.code):
+                    raise Exception(f'{name} entry point {entry} is past the end of the code ({len(self.code)} bytes)')
+                self.labels.setdefault(entry, name)
+        self.scan()
+
+    def label(self, offset: int):
+        return self.labels.setdefault(offset, f'L_{offset:06x}')
+
+    # (name, operands, size), or None for bytes that only reassemble verbatim
+    def decode(self, offset: int):
+        name = MNEMONICS.get(self.code[offset])
+        if name is None:
+            return None
+        factory = INSTRUCTIONS[name]
+        try:
+            operands, size = factory.decode(self.code, offset)
+        except Exception:
+            return None
+        if isinstance(factory, Jmp) and not self.encodable(factory, offset, operands[0]):
+            return None
+        return name, operands, size
+
+    # The compiler must encode the target back to the same operand bytes
+    def encodable(self, factory: Jmp, offset: int, target: int):
+        if not 0 <= target <= len(self.code):
+            return False
+        if not factory.relative:
+            return True
+        reference = ReferenceInstruction(factory.prefix, Reference(''), True)
+        state = CompilerState({'': target}, offset)
+        return reference.operand(state) == self.code[offset + INSTRUCTION_SIZE:offset + INSTRUCTION_SIZE + RELATIVE_REFERENCE]
+
+    def scan(self):
+        starts = bytearray(len(self.code))
+        offset = 0
+        while offset < len(self.code):
+            starts[offset] = 1
+            decoded = self.decode(offset)
+            if decoded is None:
+                self.raw.add(offset)
+                offset += 1
+                continue
+            name, operands, size = decoded
+            if isinstance(INSTRUCTIONS[name], Jmp):
+                self.label(operands[0])
+            offset += size
+        # A label inside an instruction splits it into verbatim bytes
+        for target in self.labels:
+            if target < len(self.code) and not starts[target]:
+                self.raw.add(starts.rfind(1, 0, target))
+        self.offsets = sorted(self.labels)
+
+    def format(self, name: str, operands: tuple):
+        text = [name]
+        for (kind, _), value in zip(INSTRUCTIONS[name].operands, operands):
+            if kind == 'number':
+                text.append(str(value))
+            elif kind == 'index':
+                text.append(f'#{value}')
+            elif kind == 'block':
+                text.append(f'[{value.hex()}]')
+            else:
+                text.append(f'&{self.label(value)}')
+        return ' '.join(text)
+
+    def comment(self, offset: int):
+        if self.source_map is None or offset >= self.source_map.size:
+            return f' ; {offset:06x}'
+        file, line, _ = self.source_map.lookup(offset)
+        if file is None:
+            return f' ; {offset:06x}'
+        return f' ; {offset:06x} {os.path.relpath(file) if os.path.isabs(file) else file}:{line}'
+
+    def raw_lines(self, start: int, end: int):
+        offset = start
+        while offset < end:
+            stop = min(end, offset + RAW_LINE)
+            following = bisect.bisect_right(self.offsets, offset)
+            if following < len(self.offsets):
+                stop = min(stop, self.offsets[following])
+            if offset != start and offset in self.labels:
+                yield f'{self.labels[offset]}:'
+            yield f'    .bytes [{self.code[offset:stop].hex()}]'.ljust(40) + self.comment(offset)
+            offset = stop
+
+    def lines(self):
+        for name, entry in zip(ENTRY_NAMES, self.entries):
+            if entry is not None:
+                yield f'.{name} &{self.labels[entry]}'
+        if self.initial_data is not None:
+            yield f'.data [{self.initial_data.hex()}]'
+        offset = 0
+        while offset < len(self.code):
+            if offset in self.labels:
+                yield f'{self.labels[offset]}:'
+            if offset in self.raw:
+                end = offset
+                while end < len(self.code) and end in self.raw:
+                    decoded = self.decode(end)
+                    end += 1 if decoded is None else decoded[2]
+                yield from self.raw_lines(offset, end)
+                offset = end
+                continue
+            name, operands, size = self.decode(offset)
+            yield f'    {self.format(name, operands)}'.ljust(40) + self.comment(offset)
+            offset += size
+        if len(self.code) in self.labels:
+            yield f'{self.labels[len(self.code)]}:'
+
+def reassemble(text: str):
+    tokenizer = Tokenizer(text)
+    tokenizer.parse()
+    analyser = Analyser(tokenizer.tokens)
+    analyser.analys()
+    program = Compiler(analyser.program).compile()
+    initial_data = analyser.program.initial_data.bt if analyser.program.initial_data is not None else None
+    return bytes(program), initial_data
@@ -0,0 +1,208 @@
+from compiler import *
+from cfg import JUMPS, CONDITIONAL_JUMPS
+import bisect
+import json
+
+ENTRY_NAMES = ('internal', 'external', 'view')
+METRICS = ('steps', 'cost', 'bytes')
+DEFAULT_MAX_BLOCK = 1024
+ZERO = (0, 0, 0)
+
+def add(first: tuple, second: tuple | None):
+    if second is None:
+        return None
+    return tuple(a + b for a, b in zip(first, second))
+
+def most(first: tuple | None, second: tuple | None):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return tuple(max(a, b) for a, b in zip(first, second))
+
+# Every instruction costs its opcode's weight; BPUSH counts its block, BWRITE the largest block assumed
+class CostTable:
+    def __init__(self, costs: dict[str, int] | None = None, default: int = 1, byte_cost: int = 0, max_block: int = DEFAULT_MAX_BLOCK):
+        costs = costs or {}
+        for name in costs:
+            if name not in INSTRUCTIONS:
+                raise Exception(f'Unknown opcode {name!r} in cost table')
+        self.costs = costs
+        self.default = default
+        self.byte_cost = byte_cost
+        self.max_block = max_block
+
+    # {"default": 1, "opcodes": {"BHASH": 20}, "byte": 0, "max_block": 1024}
+    @staticmethod
+    def load(stream):
+        table = json.load(stream)
+        return CostTable(table.get('opcodes'), table.get('default', 1), table.get('byte', 0), table.get('max_block', DEFAULT_MAX_BLOCK))
+
+    def weight(self, name: str, operands: tuple):
+        size = len(operands[0]) if name == 'BPUSH' else self.max_block if name == 'BWRITE' else 0
+        return (1, self.costs.get(name, self.default) + self.byte_cost * size, size)
+
+# Worst cases for one function: to its RET, and to a stop (HALT, a fault or the end of the code) inside it
+class CostSummary:
+    def __init__(self, start: int, ret: tuple | None, stop: tuple | None, loops: list[tuple[int, int]], unbounded: bool):
+        self.start = start
+        self.ret = ret
+        self.stop = stop
+        self.loops = loops
+        self.unbounded = unbounded
+
+    def worst(self):
+        return most(self.ret, self.stop) or ZERO
+
+class CostEstimator:
+    def __init__(self, program: memoryview, table: CostTable, source_map: SourceMap | None = None):
+        self.entries, header_size = parse_header(program)
+        self.code = program[header_size:]
+        self.table = table
+        self.source_map = source_map
+        self.decoded: dict[int, tuple[str, tuple, int] | None] = {}
+        offset = 0
+        while offset < len(self.code):
+            name = MNEMONICS.get(self.code[offset])
+            try:
+                operands, size = INSTRUCTIONS[name].decode(self.code, offset) if name is not None else ((), 1)
+            except Exception:
+                name, size = None, len(self.code) - offset
+            self.decoded[offset] = (name, operands, size) if name is not None else None
+            offset += size
+        self.summaries: dict[int, CostSummary] = {}
+        self.active: set[int] = set()
+        self.recursive: set[int] = set()
+        # Successor that gives the most cost, for printing worst paths
+        self.choices: dict[int, int | None] = {}
+
+    def describe(self, offset: int):
+        if self.source_map is not None and offset < self.source_map.size:
+            i = bisect.bisect_right(self.source_map.section_offsets, offset)
+            if i > 0:
+                return f'{self.source_map.section_names[i - 1]}+{offset - self.source_map.section_offsets[i - 1]}'
+        return f'{offset:06x}'
+
+    def successors(self, offset: int):
+        decoded = self.decoded.get(offset)
+        if decoded is None:
+            return []
+        name, operands, size = decoded
+        if name in ('RET', 'HALT'):
+            return []
+        if name in JUMPS:
+            return [operands[0]]
+        if name in CONDITIONAL_JUMPS or name == 'CALL':
+            return [operands[0], offset + size] if name != 'CALL' else [offset + size]
+        return [offset + size]
+
+    # Longest paths over the function's code; an edge back into the current path is a loop and adds nothing
+    def summarize(self, start: int):
+        if start in self.summaries:
+            return self.summaries[start]
+        if start in self.active:
+            self.recursive.add(start)
+            return None
+        self.active.add(start)
+        worst: dict[int, tuple[tuple | None, tuple | None]] = {}
+        entered: set[int] = set()
+        loops: list[tuple[int, int]] = []
+        unbounded = False
+        pending = [(start, False)]
+        while pending:
+            offset, done = pending.pop()
+            if not done:
+                if offset in entered:
+                    continue
+                entered.add(offset)
+                pending.append((offset, True))
+                pending.extend((successor, False) for successor in self.successors(offset) if successor not in entered)
+                continue
+            decoded = self.decoded.get(offset)
+            if decoded is None:
+                # The VM dispatches an implicit HALT at the end of the code, and counts a fault as a step
+                worst[offset] = (None, self.table.weight('HALT', ()) if offset == len(self.code) else (1, self.table.default, 0))
+                continue
+            name, operands, _ = decoded
+            own = self.table.weight(name, operands)
+            if name == 'RET':
+                worst[offset] = (own, None)
+                continue
+            if name == 'HALT':
+                worst[offset] = (None, own)
+                continue
+            ret = stop = None
+            choice = None
+            best = -1
+            for successor in self.successors(offset):
+                if successor not in worst:
+                    loops.append((offset, successor))
+                    unbounded = True
+                    continue
+                after = worst[successor]
+                if name == 'CALL':
+                    callee = self.summarize(operands[0])
+                    if callee is None:
+                        unbounded = True
+                        break
+                    unbounded = unbounded or callee.unbounded
+                    through = add(callee.ret, after[0]) if callee.ret is not None else None
+                    after = (through, most(callee.stop, add(callee.ret, after[1]) if callee.ret is not None else None))
+                cost = (most(*after) or ZERO)[1]
+                if cost > best:
+                    choice, best = successor, cost
+                ret, stop = most(ret, add(own, after[0])), most(stop, add(own, after[1]))
+            if name == 'CALL' and ret is None and stop is None:
+                stop = own
+            self.choices[offset] = choice
+            worst[offset] = (ret, stop)
+        self.active.discard(start)
+        ret, stop = worst[start]
+        summary = CostSummary(start, ret, stop, loops, unbounded or start in self.recursive)
+        self.summaries[start] = summary
+        return summary
+
+    # Jumps taken and calls made along the most expensive path from an entry
+    def worst_path(self, start: int):
+        path = [start]
+        offset = start
+        seen = set()
+        while offset in self.choices and offset not in seen:
+            seen.add(offset)
+            name, operands, size = self.decoded[offset]
+            choice = self.choices[offset]
+            if choice is None:
+                break
+            if name == 'CALL':
+                path.append(f'call {self.describe(operands[0])}')
+            elif choice != offset + size:
+                path.append(choice)
+            offset = choice
+        if path[-1] != offset:
+            path.append(offset)
+        return ' -> '.join(step if isinstance(step, str) else self.describe(step) for step in path)
+
+    def estimate(self):
+        result = {}
+        for name, entry in zip(ENTRY_NAMES, self.entries):
+            if entry is None:
+                continue
+            if entry not in self.decoded and entry != len(self.code):
+                raise Exception(f'.{name} entry {entry} is not an instruction boundary')
+            result[name] = self.summarize(entry)
+        return result
+
+    def report(self, summaries: dict[str, CostSummary]):
+        lines = [f'entry     {"steps":>10} {"cost":>10} {"bytes":>10}']
+        for name, summary in summaries.items():
+            values = ' '.join(f'{value:>10}' for value in summary.worst())
+            lines.append(f'.{name:<8} {values}' + ('  unbounded' if summary.unbounded else ''))
+            lines.append(f'  worst path: {self.worst_path(summary.start)}')
+        loops = sorted({loop for summary in self.summaries.values() for loop in summary.loops})
+        for source, target in loops:
+            lines.append(f'loop without a bound: {self.describe(source)} -> {self.describe(target)}')
+        for start in sorted(self.recursive):
+            lines.append(f'recursion without a bound: {self.describe(start)}')
+        if self.table.max_block and any(summary.worst()[2] for summary in summaries.values()):
+            lines.append(f'bytes assume BWRITE blocks of at most {self.table.max_block} bytes')
+        return '\n'.join(lines)
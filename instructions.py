@@ -3,11 +3,18 @@ from atypes import *
 INSTRUCTION_SIZE = 1
 UINT64_SIZE = 8
 RELATIVE_REFERENCE = 2
+RELATIVE_LIMIT = 0b1 << 15
 INDEX_SIZE = 2
 
 class Instruction:
+    # (Source, character offset) of the mnemonic, set by the analyser
+    location: tuple | None = None
+
     def compile(self, state: CompilerState):
         return ''.encode('utf-8')
+
+    def write(self, out: memoryview, state: CompilerState):
+        out[state.current:state.current + len(self)] = self.compile(state)
     
     def __len__(self):
         return 0
@@ -18,75 +25,166 @@ class ReferenceInstruction(Instruction):
         self.reference = reference
         self.relative = relative
 
-    def compile(self, state: CompilerState):
+    # Relative targets are counted from the end of the instruction
+    def displacement(self, state: CompilerState):
+        return state.references[self.reference.name] - (state.current + len(self.prefix) + RELATIVE_REFERENCE)
+
+    def reaches(self, state: CompilerState):
+        return -RELATIVE_LIMIT < self.displacement(state) < RELATIVE_LIMIT
+
+    def operand(self, state: CompilerState):
         if self.relative:
-            if state.current <= state.references[self.reference.name]:
-                return self.prefix + (state.references[self.reference.name] - state.current - RELATIVE_REFERENCE - 1).to_bytes(RELATIVE_REFERENCE, byteorder='big')
-            else:
-                ref = (state.current - state.references[self.reference.name] + 1 + RELATIVE_REFERENCE) | (0b1 << 15)
-                return self.prefix + ref.to_bytes(RELATIVE_REFERENCE, byteorder='big')
-        return self.prefix + state.references[self.reference.name].to_bytes(UINT64_SIZE, byteorder='big')
+            displacement = self.displacement(state)
+            if not -RELATIVE_LIMIT < displacement < RELATIVE_LIMIT:
+                raise Exception(f'Relative jump to &{self.reference.name} out of range ({displacement} bytes)')
+            if displacement >= 0:
+                return displacement.to_bytes(RELATIVE_REFERENCE, byteorder='big')
+            return (-displacement | RELATIVE_LIMIT).to_bytes(RELATIVE_REFERENCE, byteorder='big')
+        return state.references[self.reference.name].to_bytes(UINT64_SIZE, byteorder='big')
+
+    def compile(self, state: CompilerState):
+        return self.prefix + self.operand(state)
+
+    def write(self, out: memoryview, state: CompilerState):
+        start = state.current + len(self.prefix)
+        out[state.current:start] = self.prefix
+        out[start:state.current + len(self)] = self.operand(state)
     
     def __len__(self):
         if self.relative:
             return len(self.prefix) + RELATIVE_REFERENCE
         return len(self.prefix) + UINT64_SIZE
 
+class BranchInstruction(ReferenceInstruction):
+    def __init__(self, long_prefix: bytes, short_prefix: bytes, reference: Reference):
+        self.long_prefix = long_prefix
+        self.short_prefix = short_prefix
+        self.reference = reference
+        self.relative = False
+
+    @property
+    def prefix(self):
+        return self.short_prefix if self.relative else self.long_prefix
+
 class BytesInstruction(Instruction):
     def __init__(self, bts: bytes):
         self.bts = bts
 
     def compile(self, state: CompilerState = None):
         return self.bts
+
+    def write(self, out: memoryview, state: CompilerState):
+        out[state.current:state.current + len(self.bts)] = self.bts
     
     def __len__(self):
         return len(self.bts)
 
+# Verbatim bytes from .bytes, never decoded as an instruction by the tools
+class RawInstruction(BytesInstruction):
+    def __init__(self, bts: bytes):
+        super().__init__(bts)
+
+# Operand schema: (kind, size in bytes) per operand, size 0 meaning unbounded
 class InstructionFactory:
     def __init__(self, opcode: int):
         self.opcode = opcode
+        self.prefix = opcode.to_bytes(INSTRUCTION_SIZE, byteorder='big')
+        self.operands: tuple[tuple[str, int], ...] = ()
 
     def build(self):
-        return BytesInstruction(self.opcode.to_bytes(INSTRUCTION_SIZE, byteorder='big'))
+        return BytesInstruction(self.prefix)
+
+    def decode(self, code: memoryview, offset: int):
+        return (), INSTRUCTION_SIZE
 
 class IPush(InstructionFactory):
     def __init__(self, opcode, size: int):
         super().__init__(opcode)
         self.size = size
+        self.operands = (('number', size),)
 
     def build(self, value: Number):
-        return BytesInstruction(super().build().compile() + value.value.to_bytes(self.size, byteorder='big'))
+        return BytesInstruction(self.prefix + value.value.to_bytes(self.size, byteorder='big'))
+
+    def decode(self, code: memoryview, offset: int):
+        start = offset + INSTRUCTION_SIZE
+        return (int.from_bytes(operand(code, start, self.size), byteorder='big'),), INSTRUCTION_SIZE + self.size
 
 
 class Stackable(InstructionFactory):
     def __init__(self, opcode):
         super().__init__(opcode)
+        self.operands = (('index', INDEX_SIZE),)
 
     def build(self, index: Index):
-        return BytesInstruction(super().build().compile() + index.value.to_bytes(INDEX_SIZE, byteorder='big'))
+        return BytesInstruction(self.prefix + index.value.to_bytes(INDEX_SIZE, byteorder='big'))
+
+    def decode(self, code: memoryview, offset: int):
+        start = offset + INSTRUCTION_SIZE
+        return (int.from_bytes(operand(code, start, INDEX_SIZE), byteorder='big'),), INSTRUCTION_SIZE + INDEX_SIZE
 
 class BPush(InstructionFactory):
     def __init__(self, opcode):
         super().__init__(opcode)
+        self.operands = (('block', 0),)
 
     def build(self, block: Block):
-        return BytesInstruction(super().build().compile() + len(block.bt).to_bytes(UINT64_SIZE, byteorder='big') + block.bt)
+        return BytesInstruction(self.prefix + len(block.bt).to_bytes(UINT64_SIZE, byteorder='big') + block.bt)
+
+    def decode(self, code: memoryview, offset: int):
+        start = offset + INSTRUCTION_SIZE
+        length = int.from_bytes(operand(code, start, UINT64_SIZE), byteorder='big')
+        return (operand(code, start + UINT64_SIZE, length),), INSTRUCTION_SIZE + UINT64_SIZE + length
 
 class Change(InstructionFactory):
     def __init__(self, opcode):
         super().__init__(opcode)
+        self.operands = (('index', INDEX_SIZE), ('index', INDEX_SIZE))
 
     def build(self, first: Index, second: Index):
-        return BytesInstruction(super().build().compile() + first.value.to_bytes(INDEX_SIZE, byteorder='big') + second.value.to_bytes(INDEX_SIZE, byteorder='big'))
+        return BytesInstruction(self.prefix + first.value.to_bytes(INDEX_SIZE, byteorder='big') + second.value.to_bytes(INDEX_SIZE, byteorder='big'))
+
+    def decode(self, code: memoryview, offset: int):
+        start = offset + INSTRUCTION_SIZE
+        first = int.from_bytes(operand(code, start, INDEX_SIZE), byteorder='big')
+        second = int.from_bytes(operand(code, start + INDEX_SIZE, INDEX_SIZE), byteorder='big')
+        return (first, second), INSTRUCTION_SIZE + 2 * INDEX_SIZE
 
 class Jmp(InstructionFactory):
     def __init__(self, opcode, relative: bool):
         super().__init__(opcode)
         self.relative = relative
+        self.operands = (('reference', 0),)
 
     def build(self, reference: Reference):
-        return ReferenceInstruction(super().build().compile(), reference, self.relative)
+        return ReferenceInstruction(self.prefix, reference, self.relative)
+
+    # Operand is decoded to the absolute code offset of the target
+    def decode(self, code: memoryview, offset: int):
+        start = offset + INSTRUCTION_SIZE
+        if not self.relative:
+            return (int.from_bytes(operand(code, start, UINT64_SIZE), byteorder='big'),), INSTRUCTION_SIZE + UINT64_SIZE
+        raw = int.from_bytes(operand(code, start, RELATIVE_REFERENCE), byteorder='big')
+        end = start + RELATIVE_REFERENCE
+        if raw & (0b1 << 15):
+            return (end - (raw & ~(0b1 << 15)),), INSTRUCTION_SIZE + RELATIVE_REFERENCE
+        return (end + raw,), INSTRUCTION_SIZE + RELATIVE_REFERENCE
     
+def operand(code: memoryview, start: int, size: int):
+    if start + size > len(code):
+        raise Exception(f'Truncated operand at offset {start}')
+    return code[start:start + size]
+
+# Pseudo-op: the compiler picks the absolute or the relative opcode
+class Branch(Jmp):
+    def __init__(self, absolute: Jmp, relative: Jmp):
+        super().__init__(absolute.opcode, False)
+        self.long_prefix = absolute.prefix
+        self.short_prefix = relative.prefix
+
+    def build(self, reference: Reference):
+        return BranchInstruction(self.long_prefix, self.short_prefix, reference)
+
 class Counter():
     def __init__(self):
         self.value = 0
@@ -153,3 +251,21 @@ INSTRUCTIONS = {
     'MESSAGE': InstructionFactory(counter.count()),       # MESSAGE
     'SEND': InstructionFactory(counter.count()),
 }
+
+BRANCHES = {
+    'BR': ('JMP', 'RJMP'),
+    'BRT': ('JMT', 'RJMT'),
+    'BRF': ('JMF', 'RJMF'),
+}
+
+for branch, (absolute, relative) in BRANCHES.items():
+    INSTRUCTIONS[branch] = Branch(INSTRUCTIONS[absolute], INSTRUCTIONS[relative])
+
+OPERAND_TYPES = {
+    'number': Number,
+    'index': Index,
+    'block': Block,
+    'reference': Reference,
+}
+
+MNEMONICS = {factory.opcode: name for name, factory in INSTRUCTIONS.items() if not isinstance(factory, Branch)}
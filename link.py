@@ -0,0 +1,25 @@
+from linker import Linker
+from objectfile import ObjectFile
+from compiler import print_executive, write_executive
+import argparse
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument('objects', nargs='+', help='object files; the first one is the root contract')
+parser.add_argument('-o', '--output', help='write the raw binary executive to this file')
+args = parser.parse_args()
+
+objects = []
+for path in args.objects:
+    with open(path, 'rb') as f:
+        objects.append(ObjectFile.load(f))
+linker = Linker(objects)
+program = linker.link()
+if args.output is not None:
+    if linker.initial_data is None:
+        sys.exit('executive needs .data')
+    with open(args.output, 'wb') as output:
+        address = write_executive(output, program, linker.initial_data)
+    print('address: ' + address.hex())
+else:
+    print_executive(program, linker.initial_data)
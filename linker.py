@@ -0,0 +1,59 @@
+from compiler import *
+
+class Linker:
+    def __init__(self, objects: list[ObjectFile]):
+        self.objects = objects
+        self.sources = {obj.source: obj for obj in objects}
+        self.layout: list[tuple[Chunk, int]] = []
+        self.placed: set[str] = set()
+        self.references: dict[str, int] = {}
+        self.entries: list[str | None] = [None, None, None]
+        self.initial_data: bytes | None = None
+        self.size = 0
+
+    def place(self, obj: ObjectFile, active: list[str]):
+        if obj.source in active:
+            chain = active[active.index(obj.source):] + [obj.source]
+            raise Exception('Include cycle: ' + ' -> '.join(chain))
+        if obj.source in self.placed:
+            return
+        self.placed.add(obj.source)
+        for i, chunk in enumerate(obj.chunks):
+            # Same order as the macros in the source, so an include after .external can still override it
+            for j, (name, entry) in enumerate(zip(POSITIONS, (obj.internal, obj.external, obj.view))):
+                if entry is not None and obj.positions.get(name, 0) == i:
+                    self.entries[j] = entry
+            if obj.initial_data is not None and obj.positions.get('data', 0) == i:
+                self.initial_data = obj.initial_data
+            for name, offset in chunk.sections.items():
+                if name in self.references:
+                    raise Exception(f'Section {name} defined twice (in {obj.source})')
+                self.references[name] = self.size + offset
+            self.layout.append((chunk, self.size))
+            self.size += len(chunk.code)
+            if i < len(obj.includes):
+                include = obj.includes[i]
+                if include not in self.sources:
+                    raise Exception(f'No object for {include} (included from {obj.source})')
+                self.place(self.sources[include], active + [obj.source])
+
+    def link(self):
+        for obj in self.objects:
+            self.place(obj, [])
+        for entry in self.entries:
+            if entry is not None and entry not in self.references:
+                raise Exception(f'Undefined entry reference &{entry}')
+        header = build_header(self.references, self.entries)
+        program = bytearray(len(header) + self.size)
+        view = memoryview(program)
+        view[:len(header)] = header
+        code = view[len(header):]
+        state = CompilerState(self.references, 0)
+        for chunk, base in self.layout:
+            code[base:base + len(chunk.code)] = chunk.code
+            for relocation in chunk.relocations:
+                if relocation.name not in self.references:
+                    raise Exception(f'Undefined reference &{relocation.name}')
+                state.current = base + relocation.offset
+                relocation.instruction().write(code, state)
+        return program
@@ -0,0 +1,190 @@
+from vm import *
+from replayer import Snapshot
+from deployer import SEND_PATH, percentile
+from transport import HttpError, read_request, write_response
+from collections import deque
+import asyncio
+import hashlib
+import json
+import time
+
+MAX_BODY = 16 << 20
+MAX_HOPS = 64
+LATENCY_WINDOW = 10000
+MESSAGE_TYPES = {'external': EXTERNAL, 'internal': INTERNAL}
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# Stands in for a node: contracts live at the sha256 of their executive, SEND output is queued and delivered in order
+class LocalNode:
+    def __init__(self, max_steps: int = MAX_STEPS, max_hops: int = MAX_HOPS, fuse: bool = True):
+        self.max_steps = max_steps
+        self.max_hops = max_hops
+        self.fuse = fuse
+        self.machines: dict[bytes, Machine] = {}
+        self.state = Snapshot()
+        self.queue: asyncio.Queue[tuple[Message, int]] = asyncio.Queue()
+        self.started = time.perf_counter()
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.executed = 0
+        self.failed = 0
+        self.delivered = 0
+        self.undeliverable = 0
+        self.dropped = 0
+        self.steps = 0
+
+    def deploy(self, receiver: bytes, init: dict):
+        try:
+            program, data = bytes.fromhex(init['program']), bytes.fromhex(init['data'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise RequestError(400, f'Bad init: {e}')
+        executive = build_executive(program, data)
+        if hashlib.sha256(executive).digest() != receiver:
+            raise RequestError(400, 'receiver is not the sha256 of the executive')
+        if receiver not in self.machines:
+            try:
+                self.machines[receiver] = Machine(program, receiver, self.max_steps, self.fuse)
+            except Exception as e:
+                raise RequestError(400, f'Bad program: {e}')
+            self.state.set(receiver, data)
+        return executive
+
+    def execute(self, message: Message, hops: int):
+        machine = self.machines[message.receiver]
+        execution = machine.run('external' if message.type == EXTERNAL else 'internal', self.state.get(message.receiver), message)
+        self.executed += 1
+        self.steps += execution.steps
+        self.state.set(message.receiver, execution.data)
+        for sent in execution.sent:
+            if hops + 1 > self.max_hops:
+                self.dropped += 1
+            else:
+                self.queue.put_nowait((sent, hops + 1))
+        return execution
+
+    def send(self, payload):
+        if not isinstance(payload, dict):
+            raise RequestError(400, 'Expected a JSON object')
+        try:
+            message_type = MESSAGE_TYPES[payload.get('type', 'external')]
+            receiver = bytes.fromhex(payload['receiver'])
+            opcode = int(payload.get('opcode', 0))
+            if not 0 <= opcode <= UINT64_MASK:
+                raise ValueError(f'opcode {opcode} is not a uint64')
+            body = bytes.fromhex(payload.get('body', ''))
+        except (KeyError, TypeError, ValueError) as e:
+            raise RequestError(400, f'Bad message: {type(e).__name__}: {e}')
+        init = b''
+        if payload.get('init') is not None:
+            init = self.deploy(receiver, payload['init'])
+        if receiver not in self.machines:
+            raise RequestError(404, f'No contract at {receiver.hex()}, send init with the first message')
+        message = Message(message_type, b'', receiver, init, opcode, body, int(time.time()))
+        try:
+            execution = self.execute(message, 0)
+        except ExecutionError as e:
+            self.failed += 1
+            raise RequestError(422, f'Execution failed: {e}')
+        return {'status': 'ok', 'address': receiver.hex(), 'steps': execution.steps, 'sent': len(execution.sent), 'data': execution.data.hex()}
+
+    # Internal messages run one at a time after the request that sent them has been answered
+    async def deliver(self):
+        while True:
+            message, hops = await self.queue.get()
+            if message.receiver not in self.machines:
+                self.undeliverable += 1
+            else:
+                try:
+                    self.execute(message, hops)
+                    self.delivered += 1
+                except Exception:
+                    # An ExecutionError is the contract's fault, anything else must not stop delivery either
+                    self.failed += 1
+            self.queue.task_done()
+
+    def metrics(self):
+        elapsed = time.perf_counter() - self.started
+        latencies = sorted(self.latencies)
+        return {
+            'uptime': elapsed,
+            'contracts': len(self.machines),
+            'requests': self.requests,
+            'executed': self.executed,
+            'failed': self.failed,
+            'delivered': self.delivered,
+            'undeliverable': self.undeliverable,
+            'dropped': self.dropped,
+            'queued': self.queue.qsize(),
+            'steps': self.steps,
+            'messages_per_second': self.executed / elapsed if elapsed else 0.0,
+            'latency_ms': {f'p{int(q * 100)}': 1000 * percentile(latencies, q) for q in (0.5, 0.9, 0.99)},
+        }
+
+    def route(self, method: str, path: str, body: bytes):
+        if path == SEND_PATH:
+            if method != 'POST':
+                raise RequestError(405, f'{method} {path}')
+            try:
+                payload = json.loads(body)
+            except ValueError as e:
+                raise RequestError(400, f'Bad JSON: {e}')
+            return self.send(payload)
+        if path == '/metrics' and method == 'GET':
+            return self.metrics()
+        if path.startswith('/contract/') and method == 'GET':
+            try:
+                address = bytes.fromhex(path[len('/contract/'):])
+            except ValueError:
+                raise RequestError(400, 'Bad address')
+            data = self.state.get(address) if address in self.machines else None
+            if data is None:
+                raise RequestError(404, f'No contract at {address.hex()}')
+            return {'address': address.hex(), 'data': data.hex()}
+        raise RequestError(404, f'{method} {path}')
+
+    async def connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, MAX_BODY)
+                except (HttpError, ValueError, asyncio.IncompleteReadError) as e:
+                    write_response(writer, 400, json.dumps({'error': str(e)}).encode('utf-8'), keep_alive=False)
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                method, path, headers, body = request
+                start = time.perf_counter()
+                self.requests += 1
+                try:
+                    status, result = 200, self.route(method, path, body)
+                except RequestError as e:
+                    status, result = e.status, {'error': str(e)}
+                except Exception as e:
+                    status, result = 500, {'error': f'{type(e).__name__}: {e}'}
+                if path == SEND_PATH:
+                    self.latencies.append(time.perf_counter() - start)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                write_response(writer, status, json.dumps(result).encode('utf-8'), keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int, ready=None):
+        delivery = asyncio.create_task(self.deliver())
+        server = await asyncio.start_server(self.connection, host, port)
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            delivery.cancel()
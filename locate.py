@@ -0,0 +1,12 @@
+from sourcemap import SourceMap
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('map', help='source map written by compile.py -g')
+parser.add_argument('offsets', nargs='+', help='code offsets as reported by the node or the VM, decimal or 0x hex')
+args = parser.parse_args()
+
+with open(args.map, 'rb') as f:
+    source_map = SourceMap.load(f)
+for offset in args.offsets:
+    print(f'{offset}: {source_map.describe(int(offset, 0))}')
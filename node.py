@@ -0,0 +1,28 @@
+from localnode import LocalNode, MAX_HOPS
+import argparse
+import asyncio
+import json
+import signal
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', default='localhost')
+parser.add_argument('-p', '--port', type=int, default=8080)
+parser.add_argument('--max-steps', type=int, default=1_000_000)
+parser.add_argument('--max-hops', type=int, default=MAX_HOPS, help='drop internal messages after this many SEND hops from the request')
+parser.add_argument('--no-fuse', action='store_true', help='dispatch every instruction instead of fused idioms')
+args = parser.parse_args()
+
+node = LocalNode(args.max_steps, args.max_hops, not args.no_fuse)
+
+def ready(server):
+    for socket in server.sockets:
+        print(f'listening on http://{socket.getsockname()[0]}:{socket.getsockname()[1]}', file=sys.stderr)
+
+# Stop on SIGTERM the way Ctrl-C does, so the final metrics are printed either way
+signal.signal(signal.SIGTERM, signal.default_int_handler)
+try:
+    asyncio.run(node.serve(args.host, args.port, ready))
+except KeyboardInterrupt:
+    pass
+print(json.dumps(node.metrics(), indent=1), file=sys.stderr)
@@ -0,0 +1,123 @@
+from instructions import *
+
+OBJECT_MAGIC = b'TFSO'
+OBJECT_VERSION = 2
+POSITIONS = ('internal', 'external', 'view', 'data')
+
+class Relocation:
+    def __init__(self, offset: int, prefix: bytes, name: str, relative: bool):
+        self.offset = offset
+        self.prefix = prefix
+        self.name = name
+        self.relative = relative
+
+    def instruction(self):
+        return ReferenceInstruction(self.prefix, Reference(self.name), self.relative)
+
+    def __str__(self):
+        return f'Relocation(offset={self.offset}, name=\'{self.name}\', relative={self.relative})'
+
+    def __repr__(self):
+        return self.__str__()
+
+class Chunk:
+    def __init__(self, code: bytes, sections: dict[str, int], relocations: list[Relocation]):
+        self.code = code
+        self.sections = sections
+        self.relocations = relocations
+
+class ObjectFile:
+    def __init__(self, source: str):
+        self.source = source
+        self.chunks: list[Chunk] = []
+        self.includes: list[str] = []
+        self.internal: str | None = None
+        self.external: str | None = None
+        self.view: str | None = None
+        self.initial_data: bytes | None = None
+        # Chunk index each of POSITIONS was last set before, includes in between can override it
+        self.positions: dict[str, int] = {}
+
+    def save(self, stream):
+        stream.write(OBJECT_MAGIC + OBJECT_VERSION.to_bytes(INSTRUCTION_SIZE, byteorder='big'))
+        write_block(stream, self.source.encode('utf-8'))
+        for entry in (self.internal, self.external, self.view):
+            write_optional(stream, entry.encode('utf-8') if entry is not None else None)
+        write_optional(stream, self.initial_data)
+        for name in POSITIONS:
+            write_uint(stream, self.positions.get(name, 0))
+        write_uint(stream, len(self.chunks))
+        for chunk in self.chunks:
+            write_block(stream, chunk.code)
+            write_uint(stream, len(chunk.sections))
+            for name, offset in chunk.sections.items():
+                write_block(stream, name.encode('utf-8'))
+                write_uint(stream, offset)
+            write_uint(stream, len(chunk.relocations))
+            for relocation in chunk.relocations:
+                write_uint(stream, relocation.offset)
+                write_block(stream, relocation.prefix)
+                stream.write(b'\1' if relocation.relative else b'\0')
+                write_block(stream, relocation.name.encode('utf-8'))
+        write_uint(stream, len(self.includes))
+        for include in self.includes:
+            write_block(stream, include.encode('utf-8'))
+
+    @staticmethod
+    def load(stream):
+        header = stream.read(len(OBJECT_MAGIC) + INSTRUCTION_SIZE)
+        if header[:len(OBJECT_MAGIC)] != OBJECT_MAGIC:
+            raise Exception('Not an object file')
+        if header[len(OBJECT_MAGIC)] != OBJECT_VERSION:
+            raise Exception(f'Unsupported object version {header[len(OBJECT_MAGIC)]}')
+        obj = ObjectFile(read_block(stream).decode('utf-8'))
+        entries = [read_optional(stream) for _ in range(3)]
+        obj.internal, obj.external, obj.view = [entry.decode('utf-8') if entry is not None else None for entry in entries]
+        obj.initial_data = read_optional(stream)
+        obj.positions = {name: read_uint(stream) for name in POSITIONS}
+        for _ in range(read_uint(stream)):
+            code = read_block(stream)
+            sections = {}
+            for _ in range(read_uint(stream)):
+                name = read_block(stream).decode('utf-8')
+                sections[name] = read_uint(stream)
+            relocations = []
+            for _ in range(read_uint(stream)):
+                offset = read_uint(stream)
+                prefix = read_block(stream)
+                relative = stream.read(1) == b'\1'
+                relocations.append(Relocation(offset, prefix, read_block(stream).decode('utf-8'), relative))
+            obj.chunks.append(Chunk(code, sections, relocations))
+        obj.includes = [read_block(stream).decode('utf-8') for _ in range(read_uint(stream))]
+        return obj
+
+def write_uint(stream, value: int):
+    stream.write(value.to_bytes(UINT64_SIZE, byteorder='big'))
+
+def write_block(stream, bt: bytes):
+    write_uint(stream, len(bt))
+    stream.write(bt)
+
+def write_optional(stream, bt: bytes | None):
+    if bt is None:
+        stream.write(b'\0')
+    else:
+        stream.write(b'\1')
+        write_block(stream, bt)
+
+def read_exact(stream, size: int):
+    bt = stream.read(size)
+    if len(bt) != size:
+        raise Exception('Truncated object file')
+    return bt
+
+def read_uint(stream):
+    return int.from_bytes(read_exact(stream, UINT64_SIZE), byteorder='big')
+
+def read_block(stream):
+    return read_exact(stream, read_uint(stream))
+
+def read_optional(stream):
+    if read_exact(stream, 1) == b'\0':
+        return None
+    return read_block(stream)
@@ -0,0 +1,278 @@
+from cfg import *
+from collections import Counter
+
+UINT64_LIMIT = 1 << 64
+IPUSH8_LIMIT = 1 << 8
+INDEX_LIMIT = 1 << 8 * INDEX_SIZE
+
+ARITHMETIC = {
+    'ADD': lambda a, b: a + b,
+    'SUB': lambda a, b: a - b,
+    'MUL': lambda a, b: a * b,
+    'DIV': lambda a, b: a // b if b else None,
+    'MOD': lambda a, b: a % b if b else None,
+}
+
+COMPARISONS = {
+    'CMB': lambda a, b: a > b,
+    'CML': lambda a, b: a < b,
+    'CMBE': lambda a, b: a >= b,
+    'CMLE': lambda a, b: a <= b,
+    'CME': lambda a, b: a == b,
+    'CMNE': lambda a, b: a != b,
+}
+
+def build(name: str, *operands):
+    factory = INSTRUCTIONS[name]
+    return factory.build(*(OPERAND_TYPES[kind](value) for (kind, _), value in zip(factory.operands, operands)))
+
+def build_push(value: int):
+    return build('IPUSH8' if value < IPUSH8_LIMIT else 'IPUSH64', value)
+
+def is_push(window, i: int):
+    return window[i][0] in ('IPUSH8', 'IPUSH64')
+
+def rule_swap_swap(window):
+    if len(window) >= 2 and window[0][0] == 'SWAP' and window[1][0] == 'SWAP':
+        return 2, []
+
+def rule_dropn_zero(window):
+    if window[0] == ('DROPN', (0,)):
+        return 1, []
+
+def rule_chg_same(window):
+    if window[0][0] == 'CHG' and window[0][1][0] == window[0][1][1]:
+        return 1, []
+
+def rule_narrow_push(window):
+    if window[0][0] == 'IPUSH64' and window[0][1][0] < IPUSH8_LIMIT:
+        return 1, [build('IPUSH8', window[0][1][0])]
+
+def rule_fold_arithmetic(window):
+    if len(window) >= 3 and is_push(window, 0) and is_push(window, 1) and window[2][0] in ARITHMETIC:
+        value = ARITHMETIC[window[2][0]](window[0][1][0], window[1][1][0])
+        if value is not None and 0 <= value < UINT64_LIMIT:
+            return 3, [build_push(value)]
+
+def rule_fold_comparison(window):
+    if len(window) >= 3 and is_push(window, 0) and is_push(window, 1) and window[2][0] in COMPARISONS:
+        return 3, [build_push(int(COMPARISONS[window[2][0]](window[0][1][0], window[1][1][0])))]
+
+def rule_fold_inc(window):
+    if len(window) >= 2 and is_push(window, 0) and window[1][0] == 'INC' and window[0][1][0] + 1 < UINT64_LIMIT:
+        return 2, [build_push(window[0][1][0] + 1)]
+
+def rule_dropn_merge(window):
+    if len(window) >= 2 and window[0][0] == 'DROPN' and window[1][0] == 'DROPN' and window[0][1][0] + window[1][1][0] < INDEX_LIMIT:
+        return 2, [build('DROPN', window[0][1][0] + window[1][1][0])]
+
+# A CHG that only moves values the next DROPN removes does nothing
+def rule_chg_dropped(window):
+    if len(window) >= 2 and window[0][0] == 'CHG' and window[1][0] == 'DROPN' and max(window[0][1]) < window[1][1][0]:
+        return 1, []
+
+# Fix-ups around inlined bodies: drop once after the CHG instead of before and after it
+def rule_dropn_chg_dropn(window):
+    if len(window) >= 3 and window[0][0] == 'DROPN' and window[1][0] == 'CHG' and window[2][0] == 'DROPN':
+        count = window[0][1][0]
+        first, second = window[1][1]
+        if max(first, second) + count < INDEX_LIMIT and count + window[2][1][0] < INDEX_LIMIT:
+            return 3, [build('CHG', first + count, second + count), build('DROPN', count + window[2][1][0])]
+
+def rule_push_drop(window):
+    if len(window) >= 2 and window[0][0] in ('IPUSH8', 'IPUSH64', 'BPUSH') and window[1][0] == 'DROPN' and window[1][1][0] > 0:
+        return 2, [build('DROPN', window[1][1][0] - 1)]
+
+def rule_chg_swap(window):
+    if window[0][0] == 'CHG' and sorted(window[0][1]) == [0, 1]:
+        return 1, [build('SWAP')]
+
+def rule_tail_call(window):
+    if len(window) >= 2 and window[0][0] == 'CALL' and window[1][0] == 'RET':
+        return 2, [build('JMP', window[0][1][0])]
+
+PEEPHOLE_RULES = {
+    'swap-swap': rule_swap_swap,
+    'dropn-zero': rule_dropn_zero,
+    'chg-same': rule_chg_same,
+    'narrow-push': rule_narrow_push,
+    'fold-arithmetic': rule_fold_arithmetic,
+    'fold-comparison': rule_fold_comparison,
+    'fold-inc': rule_fold_inc,
+    'tail-call': rule_tail_call,
+    'dropn-merge': rule_dropn_merge,
+    'chg-dropped': rule_chg_dropped,
+    'dropn-chg-dropn': rule_dropn_chg_dropn,
+    'push-drop': rule_push_drop,
+    'chg-swap': rule_chg_swap,
+}
+
+# Longest window any rule looks at
+WINDOW = 3
+
+# Bytes of growth allowed per inlined subroutine
+INLINE_LEVELS = {
+    'size': 0,
+    'speed': 256,
+}
+
+CALL_SIZE = len(build('CALL', ''))
+RET_SIZE = len(build('RET'))
+
+class Optimizer:
+    def __init__(self, program: Program, rules: dict | None = None):
+        self.program = program
+        self.rules = rules if rules is not None else PEEPHOLE_RULES
+        self.stats: Counter[str] = Counter()
+        self.removed: list[tuple[str | None, int]] = []
+        self.size_before = code_size(program.code)
+        self.size_after = self.size_before
+        self.bodies: dict[str, tuple[int, int]] = {}
+        self.calls: Counter[str] = Counter()
+        self.pinned: set[str] = set()
+        self.expansions: dict[str, list | None] = {}
+        # Calls expanded inside each chosen body, counted again wherever the body is spliced
+        self.nested: Counter[str] = Counter()
+        self.active: list[str] = []
+        self.recursive: set[str] = set()
+        self.limit = 0
+
+    def peephole(self, code: list):
+        result = []
+        changed = False
+        decoded = [decode_part(part) if isinstance(part, Instruction) else None for part in code]
+        i = 0
+        while i < len(code):
+            if decoded[i] is None or decoded[i][0] is None:
+                result.append(code[i])
+                i += 1
+                continue
+            window = []
+            for j in range(i, min(i + WINDOW, len(code))):
+                if decoded[j] is None or decoded[j][0] is None:
+                    break
+                window.append(decoded[j])
+            for name, rule in self.rules.items():
+                rewrite = rule(window)
+                if rewrite is not None:
+                    consumed, replacement = rewrite
+                    for part in replacement:
+                        part.location = code[i].location
+                    result.extend(replacement)
+                    self.stats[name] += 1
+                    i += consumed
+                    changed = True
+                    break
+            else:
+                result.append(code[i])
+                i += 1
+        return result, changed
+
+    def optimize(self):
+        changed = True
+        while changed:
+            self.program.code, changed = self.peephole(self.program.code)
+        self.size_after = code_size(self.program.code)
+        return self.program
+
+    # Straight-line code between a label and its only RET
+    def inlinable(self, flow: ControlFlow, start: int, end: int):
+        if end - start < 2 or flow.decoded[end - 1][0] != 'RET':
+            return False
+        for i in range(start + 1, end - 1):
+            name = flow.decoded[i][0]
+            if not isinstance(self.program.code[i], Instruction) or name is None or name in JUMPS + CONDITIONAL_JUMPS + TERMINATORS:
+                return False
+        return True
+
+    # Labels that stay in place: entries, jump targets and labels reached by falling through
+    def pin(self, flow: ControlFlow):
+        self.pinned = {reference.name for reference in (self.program.internal, self.program.external, self.program.view) if reference is not None}
+        for i, (name, operands) in enumerate(flow.decoded):
+            if name == 'CALL':
+                self.calls[operands[0]] += 1
+            elif name in JUMPS + CONDITIONAL_JUMPS:
+                self.pinned.add(operands[0])
+        # Nothing falls into the first label
+        previous = 'RET'
+        for part, (name, _) in zip(self.program.code, flow.decoded):
+            if isinstance(part, Section) and previous not in JUMPS + TERMINATORS:
+                self.pinned.add(part.name)
+            previous = name if isinstance(part, Instruction) else None
+
+    # Body of label with chosen callees already expanded, or None if label is not inlined
+    def expansion(self, label: str):
+        if label in self.expansions:
+            return self.expansions[label]
+        if label in self.active:
+            self.recursive.add(label)
+            return None
+        self.active.append(label)
+        start, end = self.bodies[label]
+        body = []
+        nested = 0
+        for part in self.program.code[start + 1:end - 1]:
+            name, operands = decode_part(part)
+            callee = self.expansion(operands[0]) if name == 'CALL' and operands[0] in self.bodies else None
+            if callee is not None:
+                nested += 1 + self.nested[operands[0]]
+            body.extend(callee if callee is not None else [part])
+        self.nested[label] = nested
+        self.active.pop()
+        size = code_size(body)
+        growth = self.calls[label] * (size - CALL_SIZE)
+        if label not in self.pinned:
+            growth -= size + RET_SIZE
+        chosen = label not in self.recursive and self.calls[label] > 0 and growth <= self.limit
+        self.expansions[label] = body if chosen else None
+        return self.expansions[label]
+
+    def inline(self, limit: int = INLINE_LEVELS['size']):
+        flow = ControlFlow(self.program)
+        self.limit = limit
+        self.bodies = {name: (start, end) for name, start, end in flow.regions() if name is not None and self.inlinable(flow, start, end)}
+        self.pin(flow)
+        for label in self.bodies:
+            self.expansion(label)
+        code = []
+        for name, start, end in flow.regions():
+            if name is not None and self.expansions.get(name) is not None and name not in self.pinned:
+                self.removed.append((name, code_size(self.program.code[start:end])))
+                continue
+            for i in range(start, end):
+                name, operands = flow.decoded[i]
+                body = self.expansions.get(operands[0]) if name == 'CALL' else None
+                if body is not None:
+                    code.extend(body)
+                    self.stats['inline'] += 1 + self.nested[operands[0]]
+                else:
+                    code.append(self.program.code[i])
+        self.program.code = code
+        self.size_after = code_size(self.program.code)
+        return self.program
+
+    def eliminate_dead_code(self):
+        flow = ControlFlow(self.program)
+        entries = flow.entries()
+        if not entries:
+            return self.program
+        reachable = flow.reachable(list(entries.values()))
+        code = []
+        for name, start, end in flow.regions():
+            if any(i in reachable for i in range(start, end)):
+                code.extend(self.program.code[start:end])
+            else:
+                self.removed.append((name, code_size(self.program.code[start:end])))
+        self.program.code = code
+        self.size_after = code_size(self.program.code)
+        return self.program
+
+    def report(self):
+        lines = [f'{name}: {count}' for name, count in self.stats.most_common()]
+        for name, size in self.removed:
+            lines.append(f'removed {name if name is not None else "<unlabelled>"}: {size} bytes')
+        lines.append(f'size: {self.size_before} -> {self.size_after} bytes')
+        return '\n'.join(lines)
+
+def code_size(code: list):
+    return sum(len(part) for part in code if isinstance(part, Instruction))
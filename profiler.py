@@ -0,0 +1,96 @@
+from vm import *
+from sourcemap import SourceMap
+from collections import Counter
+import bisect
+
+HOT_LINES = 20
+
+class ProfilingMachine(Machine):
+    def __init__(self, program: bytes, references: dict[str, int], address: bytes = b'', max_steps: int = MAX_STEPS, source_map: SourceMap | None = None):
+        super().__init__(program, address, max_steps, fuse=False)
+        starts = sorted((offset, name) for name, offset in references.items())
+        offsets = [offset for offset, _ in starts]
+        self.sections: list[str] = []
+        for offset in self.offsets:
+            i = bisect.bisect_right(offsets, offset)
+            self.sections.append(starts[i - 1][1] if i > 0 else '<start>')
+        self.labels = [name if name is not None else '<end>' for name in self.names]
+        self.source_map = source_map
+        self.hits = [0] * len(self.ops)
+        self.opcodes: Counter[str] = Counter()
+        self.section_counts: Counter[str] = Counter()
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.runs = 0
+
+    def execute(self, ip: int):
+        ops = self.ops
+        labels = self.labels
+        sections = self.sections
+        opcodes = self.opcodes
+        section_counts = self.section_counts
+        stacks = self.stacks
+        hits = self.hits
+        frame = (sections[ip],)
+        steps = 0
+        self.runs += 1
+        try:
+            for steps in range(1, self.max_steps + 1):
+                handler, arg = ops[ip]
+                opcodes[labels[ip]] += 1
+                section_counts[sections[ip]] += 1
+                stacks[frame] += 1
+                hits[ip] += 1
+                ip += 1
+                jump = handler(self, arg)
+                if jump is not None:
+                    if jump < 0:
+                        break
+                    if handler is op_call:
+                        frame = frame + (sections[jump],)
+                    elif handler is op_ret:
+                        frame = frame[:-1]
+                    ip = jump
+            else:
+                raise ExecutionError(f'Step limit of {self.max_steps} exceeded', self.offsets[ip])
+        except (ExecutionError,) + RUNTIME_ERRORS as e:
+            raise self.fault(e, ip - 1)
+        return steps
+
+    def line_counts(self):
+        counts: Counter[str] = Counter()
+        for offset, count in zip(self.offsets, self.hits):
+            if count:
+                file, line, _ = self.source_map.lookup(offset)
+                counts[f'{os.path.basename(file)}:{line}' if file is not None else '<unknown>'] += count
+        return counts
+
+    def functions(self):
+        inclusive: Counter[str] = Counter()
+        exclusive: Counter[str] = Counter()
+        for frame, count in self.stacks.items():
+            exclusive[frame[-1]] += count
+            for name in set(frame):
+                inclusive[name] += count
+        return inclusive, exclusive
+
+    def report(self):
+        total = sum(self.opcodes.values()) or 1
+        lines = [f'{sum(self.opcodes.values())} instructions in {self.runs} runs', '', 'opcode            count      %']
+        for name, count in self.opcodes.most_common():
+            lines.append(f'{name:<12} {count:>10} {100 * count / total:>6.2f}')
+        lines += ['', 'section                       count      %']
+        for name, count in self.section_counts.most_common():
+            lines.append(f'{name:<24} {count:>10} {100 * count / total:>6.2f}')
+        inclusive, exclusive = self.functions()
+        lines += ['', 'function                  inclusive  exclusive']
+        for name, count in inclusive.most_common():
+            lines.append(f'{name:<24} {count:>10} {exclusive[name]:>10}')
+        if self.source_map is not None:
+            lines += ['', 'line                          count      %']
+            for name, count in self.line_counts().most_common(HOT_LINES):
+                lines.append(f'{name:<24} {count:>10} {100 * count / total:>6.2f}')
+        return '\n'.join(lines)
+
+    def write_collapsed(self, stream):
+        for frame, count in sorted(self.stacks.items()):
+            stream.write(';'.join(frame) + f' {count}\n')
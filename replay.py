@@ -0,0 +1,49 @@
+from assembler import assemble_file
+from replayer import Snapshot, pack_messages, read_messages, replay_scenarios
+import argparse
+import json
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('logs', nargs='+', help='message logs, one scenario each: binary MESSAGE encodings back to back, or .jsonl')
+parser.add_argument('-c', '--contract', action='append', required=True, help='.tfsm contract that receives messages (repeatable)')
+parser.add_argument('--state', help='JSON {address: data} snapshot to start from, over the contracts\' .data')
+parser.add_argument('-j', '--jobs', type=int, help='worker processes for independent scenarios')
+parser.add_argument('--max-steps', type=int, default=1_000_000)
+parser.add_argument('--no-fuse', action='store_true', help='dispatch every instruction instead of fused idioms')
+parser.add_argument('-o', '--output', help='write one JSON line per scenario with its final state to this file')
+parser.add_argument('--pack', help='convert the logs into one binary log at this path instead of replaying')
+args = parser.parse_args()
+
+if args.pack is not None:
+    with open(args.pack, 'wb') as f:
+        size = pack_messages((message for log in args.logs for message in read_messages(log)), f)
+    print(f'{size} bytes written to {args.pack}', file=sys.stderr)
+    sys.exit(0)
+
+programs = {}
+snapshot = Snapshot()
+for contract in args.contract:
+    assembly = assemble_file(contract)
+    if assembly.address is None:
+        sys.exit(f'{contract} has no .data, so it has no address')
+    programs[assembly.address] = assembly.program
+    snapshot.set(assembly.address, assembly.initial_data)
+if args.state is not None:
+    with open(args.state, encoding='utf-8') as f:
+        snapshot.changes.update(Snapshot.from_json(json.load(f)).changes)
+
+output = open(args.output, 'w', encoding='utf-8') if args.output is not None else None
+total = 0
+start = time.perf_counter()
+for result in replay_scenarios(programs, snapshot, args.logs, args.jobs, args.max_steps, not args.no_fuse, output is not None):
+    total += result.messages
+    rate = result.messages / result.seconds if result.seconds else 0
+    print(f'{result.scenario}: {result.messages} messages, {result.failed} failed, {result.skipped} skipped, {result.sent} sent, {rate:.0f} msg/s, state {result.digest}')
+    if output is not None:
+        output.write(json.dumps(result.to_json()) + '\n')
+elapsed = time.perf_counter() - start
+if output is not None:
+    output.close()
+print(f'{total} messages in {elapsed:.2f}s, {total / elapsed:.0f} msg/s', file=sys.stderr)
@@ -0,0 +1,146 @@
+from vm import *
+from codec import MESSAGE_SCHEMA
+from disassembler import map_file
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import time
+
+# Contract data by address. A fork reads through to its parent and keeps its own writes,
+# data is immutable bytes so every scenario forked from one snapshot shares it until SDATA
+class Snapshot:
+    def __init__(self, changes: dict[bytes, bytes] | None = None, parent: 'Snapshot | None' = None):
+        self.changes = changes if changes is not None else {}
+        self.parent = parent
+
+    def get(self, address: bytes):
+        snapshot = self
+        while snapshot is not None:
+            data = snapshot.changes.get(address)
+            if data is not None:
+                return data
+            snapshot = snapshot.parent
+        return None
+
+    def set(self, address: bytes, data: bytes):
+        self.changes[address] = data
+
+    def fork(self):
+        return Snapshot(parent=self)
+
+    def items(self):
+        chain = []
+        snapshot = self
+        while snapshot is not None:
+            chain.append(snapshot.changes)
+            snapshot = snapshot.parent
+        merged = {}
+        for changes in reversed(chain):
+            merged.update(changes)
+        return merged
+
+    def digest(self):
+        digest = hashlib.sha256()
+        for address, data in sorted(self.items().items()):
+            digest.update(len(address).to_bytes(UINT64_SIZE, byteorder='big') + address)
+            digest.update(len(data).to_bytes(UINT64_SIZE, byteorder='big') + data)
+        return digest.hexdigest()
+
+    def to_json(self):
+        return {address.hex(): data.hex() for address, data in self.items().items()}
+
+    @staticmethod
+    def from_json(state: dict):
+        return Snapshot({bytes.fromhex(address): bytes.fromhex(data) for address, data in state.items()})
+
+# Binary logs are MESSAGE encodings back to back; JSON lines hold [type, sender, receiver, init, opcode, data, timestamp] with hex blocks
+def read_messages(path: str):
+    if path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield Message(*MESSAGE_SCHEMA.from_json(json.loads(line)))
+        return
+    view = map_file(path)
+    offset = 0
+    while offset < len(view):
+        message, offset = Message.decode(view, offset)
+        yield message
+
+def pack_messages(messages, stream):
+    buffer, _ = MESSAGE_SCHEMA.encode_batch([(message.type, message.sender, message.receiver, message.init, message.opcode, message.data, message.timestamp) for message in messages])
+    stream.write(buffer)
+    return len(buffer)
+
+class ReplayResult:
+    def __init__(self, scenario: str, messages: int, failed: int, skipped: int, sent: int, steps: int, seconds: float, digest: str, state: dict | None = None):
+        self.scenario = scenario
+        self.messages = messages
+        self.failed = failed
+        self.skipped = skipped
+        self.sent = sent
+        self.steps = steps
+        self.seconds = seconds
+        self.digest = digest
+        self.state = state
+
+    def to_json(self):
+        record = dict(vars(self))
+        record['messages_per_second'] = self.messages / self.seconds if self.seconds else None
+        if self.state is None:
+            del record['state']
+        return record
+
+# One predecoded Machine per contract; a failed message leaves the state as it was
+class Replayer:
+    def __init__(self, programs: dict[bytes, bytes], max_steps: int = MAX_STEPS, fuse: bool = True):
+        self.machines = {address: Machine(program, address, max_steps, fuse) for address, program in programs.items()}
+
+    def replay(self, snapshot: Snapshot, messages, scenario: str = '', keep_state: bool = False):
+        machines = self.machines
+        count = failed = skipped = sent = steps = 0
+        start = time.perf_counter()
+        for message in messages:
+            count += 1
+            machine = machines.get(message.receiver)
+            if machine is None:
+                skipped += 1
+                continue
+            address = machine.address
+            data = snapshot.get(address)
+            try:
+                execution = machine.run('external' if message.type == EXTERNAL else 'internal', data if data is not None else b'', message)
+            except ExecutionError:
+                failed += 1
+                continue
+            if execution.data is not data:
+                snapshot.set(address, execution.data)
+            sent += len(execution.sent)
+            steps += execution.steps
+        seconds = time.perf_counter() - start
+        return ReplayResult(scenario, count, failed, skipped, sent, steps, seconds, snapshot.digest(), snapshot.to_json() if keep_state else None)
+
+    def replay_file(self, snapshot: Snapshot, path: str, keep_state: bool = False):
+        return self.replay(snapshot.fork(), read_messages(path), path, keep_state)
+
+worker: tuple[Replayer, Snapshot] | None = None
+
+def start_worker(programs: dict[bytes, bytes], state: dict[bytes, bytes], max_steps: int, fuse: bool):
+    global worker
+    worker = (Replayer(programs, max_steps, fuse), Snapshot(state))
+
+def replay_worker(path: str, keep_state: bool):
+    replayer, snapshot = worker
+    return replayer.replay_file(snapshot, path, keep_state)
+
+# Every scenario starts from a fork of snapshot; with several jobs each worker gets its own copy of it once
+def replay_scenarios(programs: dict[bytes, bytes], snapshot: Snapshot, paths: list[str], jobs: int | None = None, max_steps: int = MAX_STEPS, fuse: bool = True, keep_state: bool = False):
+    if jobs == 1 or len(paths) == 1:
+        replayer = Replayer(programs, max_steps, fuse)
+        for path in paths:
+            yield replayer.replay_file(snapshot, path, keep_state)
+        return
+    workers = min(jobs or os.cpu_count() or 1, len(paths))
+    with ProcessPoolExecutor(max_workers=workers, initializer=start_worker, initargs=(programs, snapshot.items(), max_steps, fuse)) as executor:
+        yield from executor.map(replay_worker, paths, [keep_state] * len(paths))
@@ -0,0 +1,62 @@
+from assembler import assemble_file
+from vm import Machine, Message, ExecutionError, EXTERNAL, INTERNAL, ENTRIES
+from profiler import ProfilingMachine
+from codec import Schema
+import argparse
+import json
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('source')
+parser.add_argument('-e', '--entry', choices=ENTRIES, default='external')
+parser.add_argument('--sender', default='', help='hex')
+parser.add_argument('--opcode', type=int, default=0)
+parser.add_argument('--body', default='', help='hex')
+parser.add_argument('--data', help='hex, defaults to the contract .data')
+parser.add_argument('-n', '--repeat', type=int, default=1, help='run the message this many times')
+parser.add_argument('-p', '--profile', action='store_true', help='print per-opcode, per-section and per-call counts')
+parser.add_argument('--no-fuse', action='store_true', help='dispatch every instruction instead of fused idioms')
+parser.add_argument('--fusion-stats', action='store_true', help='print which fused idioms were found and how often they ran')
+parser.add_argument('--collapsed', help='write collapsed call stacks for flame graph tools to this file')
+parser.add_argument('--data-layout', help='schema such as "owner:block,total:u64" to print the final data as fields')
+args = parser.parse_args()
+# The profiler dispatches every instruction, so there are no fused idioms to report
+if args.fusion_stats and (args.profile or args.collapsed is not None):
+    parser.error('--fusion-stats cannot be combined with -p/--profile or --collapsed')
+
+layout = Schema.parse(args.data_layout) if args.data_layout is not None else None
+assembly = assemble_file(args.source, source_map=True)
+if args.profile or args.collapsed is not None:
+    machine = ProfilingMachine(assembly.program, assembly.references, assembly.address or b'', source_map=assembly.source_map)
+else:
+    machine = Machine(assembly.program, assembly.address or b'', fuse=not args.no_fuse)
+data = bytes.fromhex(args.data) if args.data is not None else assembly.initial_data or b''
+message = None
+if args.entry != 'view':
+    message_type = EXTERNAL if args.entry == 'external' else INTERNAL
+    message = Message(message_type, bytes.fromhex(args.sender), assembly.address or b'', b'', args.opcode, bytes.fromhex(args.body), int(time.time()))
+try:
+    for _ in range(args.repeat):
+        execution = machine.run(args.entry, data, message)
+except ExecutionError as e:
+    if e.offset is None:
+        sys.exit(f'error: {e}')
+    sys.exit(f'error: {e}\n  at {assembly.source_map.describe(e.offset)}')
+print('steps: ' + str(execution.steps))
+print('stack: ' + repr([value.hex() if isinstance(value, bytes) else value for value in execution.stack]))
+print('data: ' + execution.data.hex())
+if layout is not None:
+    fields, end = layout.decode(execution.data)
+    print('fields: ' + json.dumps(layout.to_json(fields)) + (f' (+{len(execution.data) - end} bytes)' if end < len(execution.data) else ''))
+for sent in execution.sent:
+    print('sent: ' + str(sent))
+if args.fusion_stats:
+    for name, sites, fired in machine.fusion_stats():
+        print(f'fused: {name:<24} {sites:>4} sites {fired:>10} runs')
+if args.profile:
+    print()
+    print(machine.report())
+if args.collapsed is not None:
+    with open(args.collapsed, 'w', encoding='utf-8') as f:
+        machine.write_collapsed(f)
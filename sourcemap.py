@@ -0,0 +1,141 @@
+from array import array
+import bisect
+
+SOURCE_MAP_MAGIC = b'TFSD'
+SOURCE_MAP_VERSION = 1
+
+def write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data: bytes, offset: int):
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise Exception('Truncated source map')
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def write_string(out: bytearray, text: str):
+    bt = text.encode('utf-8')
+    write_varint(out, len(bt))
+    out += bt
+
+def read_string(data: bytes, offset: int):
+    size, offset = read_varint(data, offset)
+    if offset + size > len(data):
+        raise Exception('Truncated source map')
+    return bytes(data[offset:offset + size]).decode('utf-8'), offset + size
+
+# Rows start where the (file, line) changes and cover code up to the next row
+class SourceMap:
+    def __init__(self):
+        self.files: list[str] = []
+        self.file_index: dict[str, int] = {}
+        self.offsets = array('I')
+        self.file_ids = array('I')
+        self.lines = array('I')
+        self.section_offsets = array('I')
+        self.section_names: list[str] = []
+        self.size = 0
+
+    def add(self, offset: int, file: str, line: int):
+        index = self.file_index.get(file)
+        if index is None:
+            index = self.file_index[file] = len(self.files)
+            self.files.append(file)
+        if self.offsets and self.file_ids[-1] == index and self.lines[-1] == line:
+            return
+        self.offsets.append(offset)
+        self.file_ids.append(index)
+        self.lines.append(line)
+
+    def add_section(self, name: str, offset: int):
+        self.section_offsets.append(offset)
+        self.section_names.append(name)
+
+    def section(self, offset: int):
+        i = bisect.bisect_right(self.section_offsets, offset)
+        return self.section_names[i - 1] if i > 0 else None
+
+    # (file, line, section); file and line are None before the first row
+    def lookup(self, offset: int):
+        i = bisect.bisect_right(self.offsets, offset)
+        if i == 0:
+            return None, None, self.section(offset)
+        return self.files[self.file_ids[i - 1]], self.lines[i - 1], self.section(offset)
+
+    def describe(self, offset: int):
+        if offset >= self.size:
+            return f'<past the end of the code, {self.size} bytes>'
+        file, line, section = self.lookup(offset)
+        where = f'{file}:{line}' if file is not None else '<unknown>'
+        return where if section is None else f'{where} ({section})'
+
+    def save(self, stream):
+        out = bytearray(SOURCE_MAP_MAGIC)
+        out.append(SOURCE_MAP_VERSION)
+        write_varint(out, self.size)
+        write_varint(out, len(self.files))
+        for file in self.files:
+            write_string(out, file)
+        write_varint(out, len(self.section_names))
+        previous = 0
+        for name, offset in zip(self.section_names, self.section_offsets):
+            write_varint(out, offset - previous)
+            write_string(out, name)
+            previous = offset
+        write_varint(out, len(self.offsets))
+        previous_offset = previous_line = 0
+        for offset, file, line in zip(self.offsets, self.file_ids, self.lines):
+            write_varint(out, offset - previous_offset)
+            write_varint(out, file)
+            # Zigzag, lines jump backwards when code comes from an include
+            delta = line - previous_line
+            write_varint(out, delta << 1 if delta >= 0 else (-delta << 1) - 1)
+            previous_offset, previous_line = offset, line
+        stream.write(out)
+
+    @staticmethod
+    def load(stream):
+        data = stream.read()
+        if data[:len(SOURCE_MAP_MAGIC)] != SOURCE_MAP_MAGIC:
+            raise Exception('Not a source map')
+        if len(data) <= len(SOURCE_MAP_MAGIC) or data[len(SOURCE_MAP_MAGIC)] != SOURCE_MAP_VERSION:
+            raise Exception('Unsupported source map version')
+        source_map = SourceMap()
+        offset = len(SOURCE_MAP_MAGIC) + 1
+        source_map.size, offset = read_varint(data, offset)
+        count, offset = read_varint(data, offset)
+        for _ in range(count):
+            file, offset = read_string(data, offset)
+            source_map.file_index[file] = len(source_map.files)
+            source_map.files.append(file)
+        count, offset = read_varint(data, offset)
+        position = 0
+        for _ in range(count):
+            delta, offset = read_varint(data, offset)
+            name, offset = read_string(data, offset)
+            position += delta
+            source_map.add_section(name, position)
+        count, offset = read_varint(data, offset)
+        position = line = 0
+        for _ in range(count):
+            delta, offset = read_varint(data, offset)
+            file, offset = read_varint(data, offset)
+            encoded, offset = read_varint(data, offset)
+            if file >= len(source_map.files):
+                raise Exception('Source map row refers to an unknown file')
+            position += delta
+            line += encoded >> 1 if not encoded & 1 else -((encoded + 1) >> 1)
+            source_map.offsets.append(position)
+            source_map.file_ids.append(file)
+            source_map.lines.append(line)
+        return source_map
@@ -0,0 +1,157 @@
+from cfg import *
+
+# (values that must be on the stack, change in depth)
+STACK_EFFECTS = {
+    'IPUSH64': (0, 1),
+    'IPUSH8': (0, 1),
+    'BPUSH': (0, 1),
+    'SWAP': (2, 0),
+
+    'BHASH': (1, 0),
+    'BLEN': (1, 1),
+
+    'MKSLICE': (1, 0),
+    'IREAD64': (1, 1),
+    'IREAD8': (1, 1),
+    'BREAD': (2, 0),
+    'SLLEN': (1, 1),
+
+    'MKBUILDER': (0, 1),
+    'IWRITE64': (2, -1),
+    'IWRITE8': (2, -1),
+    'BWRITE': (2, -1),
+    'BUILD': (1, 0),
+    'BLLEN': (1, 1),
+
+    'ADD': (2, -1),
+    'SUB': (2, -1),
+    'MUL': (2, -1),
+    'DIV': (2, -1),
+    'MOD': (2, -1),
+    'INC': (1, 0),
+
+    'CMB': (2, -1),
+    'CML': (2, -1),
+    'CMBE': (2, -1),
+    'CMLE': (2, -1),
+    'CME': (2, -1),
+    'CMNE': (2, -1),
+
+    'JMP': (0, 0),
+    'JMT': (1, -1),
+    'JMF': (1, -1),
+    'RJMP': (0, 0),
+    'RJMT': (1, -1),
+    'RJMF': (1, -1),
+    'RET': (0, 0),
+    'HALT': (0, 0),
+
+    'LDATA': (0, 1),
+    'SDATA': (1, -1),
+    'MESSAGE': (0, 1),
+    'SEND': (4, -4),
+}
+
+def stack_effect(name: str, operands: tuple):
+    if name == 'SPUSH':
+        return operands[0] + 1, 1
+    if name == 'DROPN':
+        return operands[0], -operands[0]
+    if name == 'CHG':
+        return max(operands) + 1, 0
+    return STACK_EFFECTS[name]
+
+class StackSummary:
+    def __init__(self, needs: int, needs_at: int | None, returns: int | None, max_depth: int):
+        self.needs = needs
+        self.needs_at = needs_at
+        self.returns = returns
+        self.max_depth = max_depth
+
+    def __str__(self):
+        return f'StackSummary(needs={self.needs}, returns={self.returns}, max_depth={self.max_depth})'
+
+    def __repr__(self):
+        return self.__str__()
+
+class StackChecker:
+    def __init__(self, program: Program):
+        self.flow = ControlFlow(program)
+        self.summaries: dict[int, StackSummary] = {}
+        self.active: list[int] = []
+
+    def describe(self, i: int):
+        if isinstance(self.flow.code[i], Section):
+            return self.flow.code[i].name
+        section = '<start>'
+        start = 0
+        for j in range(i, -1, -1):
+            if isinstance(self.flow.code[j], Section):
+                section = self.flow.code[j].name
+                start = j
+                break
+        return f'{section}+{i - start} ({self.flow.decoded[i][0]})'
+
+    # Depths are relative to the depth at the start of the function
+    def summarize(self, start: int):
+        if start in self.summaries:
+            return self.summaries[start]
+        if start in self.active:
+            raise Exception(f'Recursive call to {self.describe(start)} cannot be checked')
+        self.active.append(start)
+        depths = {start: 0}
+        needs = 0
+        needs_at = None
+        returns: int | None = None
+        max_depth = 0
+        pending = [start]
+        while pending:
+            i = pending.pop()
+            depth = depths[i]
+            successors = []
+            if isinstance(self.flow.code[i], Instruction):
+                name, operands = self.flow.decoded[i]
+                if name is None:
+                    raise Exception(f'Unknown instruction at {self.describe(i)}')
+                if name == 'CALL':
+                    target = self.flow.target(i)
+                    if target is None:
+                        raise Exception(f'Call to undefined section at {self.describe(i)}')
+                    callee = self.summarize(target)
+                    if callee.needs - depth > needs:
+                        needs, needs_at = callee.needs - depth, callee.needs_at
+                    max_depth = max(max_depth, depth + callee.max_depth)
+                    if callee.returns is not None and i + 1 < len(self.flow.code):
+                        successors = [(i + 1, depth + callee.returns)]
+                else:
+                    required, delta = stack_effect(name, operands)
+                    if required - depth > needs:
+                        needs, needs_at = required - depth, i
+                    after = depth + delta
+                    max_depth = max(max_depth, after)
+                    if name == 'RET':
+                        if returns is not None and returns != after:
+                            raise Exception(f'Stack depth mismatch at {self.describe(i)}: returns {after} values, another RET returns {returns}')
+                        returns = after
+                    successors = [(successor, after) for successor in self.flow.successors(i)]
+            else:
+                successors = [(successor, depth) for successor in self.flow.successors(i)]
+            for successor, after in successors:
+                if successor not in depths:
+                    depths[successor] = after
+                    pending.append(successor)
+                elif depths[successor] != after:
+                    raise Exception(f'Stack depth mismatch at {self.describe(successor)}: {depths[successor]} vs {after}')
+        self.active.pop()
+        summary = StackSummary(needs, needs_at, returns, max_depth)
+        self.summaries[start] = summary
+        return summary
+
+    def check(self):
+        result = {}
+        for entry, start in self.flow.entries().items():
+            summary = self.summarize(start)
+            if summary.needs > 0:
+                raise Exception(f'Stack underflow in .{entry} at {self.describe(summary.needs_at)}: {summary.needs} more values needed')
+            result[entry] = summary.max_depth
+        return result
@@ -0,0 +1,64 @@
+import os
+import random
+
+SIMPLE = ['SWAP', 'ADD', 'SUB', 'MUL', 'INC', 'CME', 'CMB', 'BLEN', 'MKSLICE', 'IREAD64', 'BREAD', 'LDATA', 'SDATA']
+JUMPS = ['JMP', 'JMT', 'JMF', 'CALL', 'BR', 'BRT', 'BRF']
+
+def instruction(rng: random.Random, labels: list[str]):
+    kind = rng.random()
+    if kind < 0.25:
+        return f'IPUSH8 {rng.randrange(256)}'
+    if kind < 0.35:
+        return f'IPUSH64 {rng.randrange(1 << 64)}'
+    if kind < 0.45:
+        return f'SPUSH #{rng.randrange(4)}'
+    if kind < 0.5:
+        return f'DROPN #{rng.randrange(3)}'
+    if kind < 0.55:
+        return f'CHG #{rng.randrange(4)} #{rng.randrange(4)}'
+    if kind < 0.6:
+        return f'BPUSH "{"x" * rng.randrange(16)}"'
+    if kind < 0.7:
+        return f'{rng.choice(JUMPS)} &{rng.choice(labels)}'
+    return rng.choice(SIMPLE)
+
+def program_lines(rng: random.Random, prefix: str, instructions: int, sections: int):
+    labels = [f'{prefix}s{i}' for i in range(max(1, sections))]
+    per_section = max(1, instructions // len(labels))
+    lines = []
+    for label in labels:
+        lines.append(f'{label}:')
+        for _ in range(per_section):
+            lines.append('    ' + instruction(rng, labels) + (' ; generated' if rng.random() < 0.05 else ''))
+        lines.append('    RET')
+    return lines, labels
+
+def generate(directory: str, instructions: int, sections: int = 0, include_depth: int = 0, include_fanout: int = 2, data_size: int = 16, seed: int = 0):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    sections = sections or max(1, instructions // 50)
+    files = sum(include_fanout ** level for level in range(include_depth + 1))
+    share = max(1, instructions // files)
+    counter = [0]
+
+    def write(level: int):
+        index = counter[0]
+        counter[0] += 1
+        name = f'f{index}.tfsm'
+        lines = []
+        if level < include_depth:
+            for _ in range(include_fanout):
+                lines.append(f'.include "{write(level + 1)}"')
+        body, labels = program_lines(rng, f'f{index}_', share, max(1, sections // files))
+        if index == 0:
+            lines = [
+                f'.external &{labels[0]}',
+                f'.internal &{labels[-1]}',
+                f'.data [{rng.randbytes(data_size).hex()}]',
+            ] + lines
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines + body) + '\n')
+        return name
+
+    write(0)
+    return os.path.join(directory, 'f0.tfsm')
@@ -0,0 +1,74 @@
+from deployer import Deployer, read_records
+from localnode import LocalNode
+from transport import HttpPool, read_request, write_response
+import asyncio
+import io
+import json
+import os
+
+ACCOUNT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', 'account.tfsm')
+
+async def deploy(lines: list[str]):
+    node = LocalNode()
+    ready = asyncio.get_running_loop().create_future()
+    serving = asyncio.create_task(node.serve('127.0.0.1', 0, lambda server: ready.set_result(server.sockets[0].getsockname()[1])))
+    port = await ready
+    # One worker so the record without init arrives after the contract is deployed
+    deployer = Deployer(f'http://127.0.0.1:{port}', concurrency=1, retries=1, backoff=0.0, timeout=5.0)
+    try:
+        await deployer.run(read_records(io.StringIO('\n'.join(lines))), keep_responses=True)
+        # Let the node see the pool's connections close before it stops
+        await asyncio.sleep(0.05)
+    finally:
+        serving.cancel()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+    return node, deployer
+
+def test_deploy_to_local_node():
+    lines = [
+        json.dumps({'contract': ACCOUNT, 'opcode': 0, 'body': ''}),
+        json.dumps({'contract': ACCOUNT, 'opcode': 1, 'body': 'not hex'}),
+        json.dumps({'contract': ACCOUNT, 'opcode': 2, 'body': '', 'init': False}),
+    ]
+    node, deployer = asyncio.run(deploy(lines))
+    assert len(deployer.responses) == 2
+    assert all(response.status == 200 for response in deployer.responses)
+    assert [response.json()['status'] for response in deployer.responses] == ['ok', 'ok']
+    assert len(node.machines) == 1
+    assert node.executed == 2
+    assert len(deployer.failures) == 1
+    record, error = deployer.failures[0]
+    assert record.contract == '<line 2>'
+    assert isinstance(error, ValueError)
+    assert deployer.retried == 0
+    assert 'sent: 2/3 (1 failed, 0 retries)' in deployer.report()
+
+# Answers the first request on each connection, then closes the next one unanswered like a server dropping an idle connection
+async def pool_after_stale_close():
+    received = []
+
+    async def connection(reader, writer):
+        while (request := await read_request(reader, 1 << 20)) is not None:
+            received.append(request[1])
+            if len(received) == 2:
+                writer.close()
+                return
+            write_response(writer, 200, b'{}')
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(connection, '127.0.0.1', 0)
+    pool = HttpPool(f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}', timeout=5.0)
+    statuses = [(await pool.request('GET', path)).status for path in ('/first', '/second')]
+    await pool.close()
+    server.close()
+    await server.wait_closed()
+    return statuses, received
+
+def test_stale_keep_alive_connection_is_retried():
+    statuses, received = asyncio.run(pool_after_stale_close())
+    assert statuses == [200, 200]
+    assert received == ['/first', '/second', '/second']
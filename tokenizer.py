@@ -1,15 +1,25 @@
+from array import array
+import bisect
+import os
+import re
+
 NEW_LINE = ['\r', '\n']
 WHITESPACE = ['\t', ' ']
 COMMENT = ';'
 STRING = '"'
 
 class Token:
-    def __init__(self, type: str):
+    __slots__ = ('type', 'offset')
+
+    def __init__(self, type: str, offset: int | None = None):
         self.type = type
+        self.offset = offset
 
 class TokenMacros(Token):
-    def __init__(self, name: str):
-        super().__init__('macros')
+    __slots__ = ('name',)
+
+    def __init__(self, name: str, offset: int | None = None):
+        super().__init__('macros', offset)
         self.name = name
 
     def __str__(self):
@@ -19,8 +29,10 @@ class TokenMacros(Token):
         return self.__str__()
 
 class TokenSection(Token):
-    def __init__(self, name: str):
-        super().__init__('section')
+    __slots__ = ('name',)
+
+    def __init__(self, name: str, offset: int | None = None):
+        super().__init__('section', offset)
         self.name = name
 
     def __str__(self):
@@ -30,8 +42,10 @@ class TokenSection(Token):
         return self.__str__()
 
 class TokenBlock(Token):
-    def __init__(self, value: str):
-        super().__init__('block')
+    __slots__ = ('value',)
+
+    def __init__(self, value: str, offset: int | None = None):
+        super().__init__('block', offset)
         self.value = value
 
     def __str__(self):
@@ -41,8 +55,10 @@ class TokenBlock(Token):
         return self.__str__()
 
 class TokenReference(Token):
-    def __init__(self, name: str):
-        super().__init__('reference')
+    __slots__ = ('name',)
+
+    def __init__(self, name: str, offset: int | None = None):
+        super().__init__('reference', offset)
         self.name = name
 
     def __str__(self):
@@ -52,8 +68,10 @@ class TokenReference(Token):
         return self.__str__()
 
 class TokenString(Token):
-    def __init__(self, value: str):
-        super().__init__('string')
+    __slots__ = ('value',)
+
+    def __init__(self, value: str, offset: int | None = None):
+        super().__init__('string', offset)
         self.value = value
 
     def __str__(self):
@@ -61,10 +79,12 @@ class TokenString(Token):
 
     def __repr__(self):
         return self.__str__()
-    
+
 class TokenNumber(Token):
-    def __init__(self, value: str):
-        super().__init__('number')
+    __slots__ = ('value',)
+
+    def __init__(self, value: str, offset: int | None = None):
+        super().__init__('number', offset)
         self.value = value
 
     def __str__(self):
@@ -72,7 +92,7 @@ class TokenNumber(Token):
 
     def __repr__(self):
         return self.__str__()
-    
+
     def size(self):
         if self.value.endswith('u8'):
             return 1
@@ -82,8 +102,10 @@ class TokenNumber(Token):
         return int(self.value)
 
 class TokenIndex(Token):
-    def __init__(self, value: str):
-        super().__init__('index')
+    __slots__ = ('value',)
+
+    def __init__(self, value: str, offset: int | None = None):
+        super().__init__('index', offset)
         self.value = value
 
     def __str__(self):
@@ -91,14 +113,16 @@ class TokenIndex(Token):
 
     def __repr__(self):
         return self.__str__()
-    
+
     def to_int(self):
         return int(self.value)
-    
+
 
 class TokenInstruction(Token):
-    def __init__(self, name: str):
-        super().__init__('index')
+    __slots__ = ('name',)
+
+    def __init__(self, name: str, offset: int | None = None):
+        super().__init__('instruction', offset)
         self.name = name
 
     def __str__(self):
@@ -107,131 +131,130 @@ class TokenInstruction(Token):
     def __repr__(self):
         return self.__str__()
 
-class Tokenizer:
-    def __init__(self, source: str):
+LEXEME = re.compile(
+    r'(?P<whitespace>[\t \r\n]+)'
+    r'|;(?P<comment>[^\r\n]*)'
+    r'|\.(?P<macros>[^\t \r\n]*)'
+    r'|&(?P<reference>[^\t \r\n]*)'
+    r'|(?P<number>\d[^\t \r\n]*)'
+    r'|"(?P<string>[^"]*)"?'
+    r'|\#(?P<index>\d*)'
+    r'|\[(?P<block>[^\t \r\n\]]*)\]?'
+    r'|(?P<word>[^\t \r\n]+)'
+)
+
+# Index in this tuple is the type id stored in a TokenStream
+TOKEN_TYPES = (TokenMacros, TokenSection, TokenBlock, TokenReference, TokenString, TokenNumber, TokenIndex, TokenInstruction)
+MACROS_ID, SECTION_ID, BLOCK_ID, REFERENCE_ID, STRING_ID, NUMBER_ID, INDEX_ID, INSTRUCTION_ID = range(len(TOKEN_TYPES))
+TOKEN_NAMES = ('macro', 'section', 'block', 'reference', 'string', 'number', 'index', 'instruction')
+# Characters in front of the stored span, so locations point at the token itself
+TOKEN_SIGILS = ('.', '', '[', '&', '"', '', '#', '')
+
+LEXEME_TYPES = {
+    'macros': MACROS_ID,
+    'reference': REFERENCE_ID,
+    'number': NUMBER_ID,
+    'string': STRING_ID,
+    'index': INDEX_ID,
+    'block': BLOCK_ID,
+    'word': INSTRUCTION_ID,
+}
+
+class Source:
+    def __init__(self, text: str, path: str | None = None):
+        self.text = text
+        self.path = path
+        self.lines: array | None = None
+
+    def location(self, offset: int):
+        if self.lines is None:
+            self.lines = array('I', [0])
+            self.lines.extend(match.end() for match in re.finditer('\n', self.text))
+        line = bisect.bisect_right(self.lines, offset)
+        return line, offset - self.lines[line - 1] + 1
+
+    def describe(self, offset: int):
+        line, column = self.location(offset)
+        return f'{self.path or "<source>"}:{line}:{column}'
+
+class TokenStream:
+    def __init__(self, source: Source):
         self.source = source
-        self.i = 0
-        self.tokens = []
-
-    def d(self):
-        return self.i < len(self.source)
-    
-    def advance(self):
-        self.i += 1
-
-    def c(self):
-        return self.source[self.i]
-    
-    def is_finish(self):
-        if self.c() in NEW_LINE or self.c() in WHITESPACE:
-            return True
-        return False
-    
-    def parse_string(self):
-        if self.c() != '"':
-            return False
-        self.advance()
-        value = ''
-        while self.d() and self.c() != '"':
-            value += self.c()
-            self.advance()
-        self.advance()
-        self.tokens.append(TokenString(value))
-        return True
-
-    def parse_macro(self):
-        if self.c() != '.':
-            return False
-        self.advance()
-        macros = ''
-        while self.d() and not self.is_finish():
-            macros += self.c()
-            self.advance()
-        self.tokens.append(TokenMacros(macros))
-        return True
-    
-    def parse_comment(self):
-        if self.c() != ';':
-            return False
-        while self.d() and self.c() not in NEW_LINE:
-            self.advance()
-        return True
-    
-    def parse_word(self):
-        if self.is_finish():
-            return False
-        identifier = ''
-        while self.d() and not self.is_finish():
-            identifier += self.c()
-            self.advance()
-        if identifier[-1] == ':':
-            self.tokens.append(TokenSection(identifier[:-1]))
-        else:
-            self.tokens.append(TokenInstruction(identifier))
-        return True
-
-    def parse_number(self):
-        if not self.c().isdigit():
-            return False
-        number = ''
-        while self.d() and not self.is_finish():
-            number += self.c()
-            self.advance()
-        self.tokens.append(TokenNumber(number))
-        return True
-
-    def parse_reference(self):
-        if self.c() != '&':
-            return False
-        self.advance()
-        name = ''
-        while self.d() and not self.is_finish():
-            name += self.c()
-            self.advance()
-        self.tokens.append(TokenReference(name))
-        return True
-    
-    def parse_index(self):
-        if self.c() != '#':
-            return False
-        self.advance()
-        index = ''
-        while self.d() and not self.is_finish() and self.c().isdigit():
-            index += self.c()
-            self.advance()
-        self.tokens.append(TokenIndex(index))
-        return True
-
-    def parse_block(self):
-        if self.c() != '[':
-            return False
-        self.advance()
-        hexed = ''
-        while self.d() and not self.is_finish() and self.c() != ']':
-            hexed += self.c()
-            self.advance()
-        if self.c() == ']':
-            self.advance()
-        self.tokens.append(TokenBlock(hexed))
-        return True
+        self.types = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.last = -1
+        self.last_token: Token | None = None
+
+    def append(self, type: int, start: int, end: int):
+        self.types.append(type)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.types)
+
+    def lexeme(self, i: int):
+        return self.source.text[self.starts[i]:self.ends[i]]
+
+    def text(self, i: int):
+        return TOKEN_SIGILS[self.types[i]] + self.lexeme(i)
+
+    def __getitem__(self, i: int):
+        if i == self.last:
+            return self.last_token
+        start = self.starts[i]
+        token = TOKEN_TYPES[self.types[i]](self.source.text[start:self.ends[i]], start)
+        self.last = i
+        self.last_token = token
+        return token
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self[i]
+
+    def describe(self, i: int):
+        if i >= len(self.types):
+            return self.source.describe(len(self.source.text))
+        return self.source.describe(self.starts[i] - len(TOKEN_SIGILS[self.types[i]]))
 
-    def parse(self):
-        while self.d():
-            if self.parse_comment():
-                continue
-            if self.parse_macro():
-                continue
-            if self.parse_reference():
-                continue
-            if self.parse_number():
-                continue
-            if self.parse_string():
-                continue
-            if self.parse_index():
-                continue
-            if self.parse_block():
-                continue
-            if self.parse_word():
+class Tokenizer:
+    def __init__(self, source: str, path: str | None = None):
+        self.source = Source(source, path)
+        self.tokens = TokenStream(self.source)
+
+    def iter_spans(self):
+        text = self.source.text
+        types = LEXEME_TYPES
+        for match in LEXEME.finditer(text):
+            type = types.get(match.lastgroup)
+            if type is None:
                 continue
-            self.advance()
+            start, end = match.span(match.lastgroup)
+            if type == INSTRUCTION_ID and text[end - 1] == ':':
+                type, end = SECTION_ID, end - 1
+            yield type, start, end
+
+    def iter_tokens(self):
+        text = self.source.text
+        for type, start, end in self.iter_spans():
+            yield TOKEN_TYPES[type](text[start:end], start)
 
+    def parse(self):
+        self.tokens = TokenStream(self.source)
+        for span in self.iter_spans():
+            self.tokens.append(*span)
+
+TOKEN_CACHE: dict[str, tuple[int, int, TokenStream]] = {}
+
+def tokenize_file(path: str):
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    cached = TOKEN_CACHE.get(path)
+    if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    with open(path, encoding='utf-8') as f:
+        tokenizer = Tokenizer(f.read(), path)
+    tokenizer.parse()
+    TOKEN_CACHE[path] = (stat.st_mtime_ns, stat.st_size, tokenizer.tokens)
+    return tokenizer.tokens
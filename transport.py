@@ -0,0 +1,149 @@
+import asyncio
+import json
+import urllib.parse
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 422: 'Unprocessable Entity', 500: 'Internal Server Error'}
+
+class HttpError(Exception):
+    pass
+
+# The request was written, so the server may have acted on it even though no response came back
+class RequestSentError(HttpError):
+    pass
+
+# A pooled connection the server closed while it sat idle, failing before any response byte; nothing ran, so the request can go out again
+class StaleConnectionError(HttpError):
+    pass
+
+class Response:
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+async def read_headers(reader: asyncio.StreamReader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise HttpError('Connection closed while reading headers')
+        line = line.strip()
+        if not line:
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+async def read_body(reader: asyncio.StreamReader, headers: dict[str, str]):
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await read_headers(reader)
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    return await reader.readexactly(int(headers.get('content-length', '0')))
+
+# (method, path, headers, body), or None when the client closed the connection between requests
+async def read_request(reader: asyncio.StreamReader, max_body: int):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise HttpError(f'Malformed request line {request_line[:100]!r}')
+    headers = await read_headers(reader)
+    if int(headers.get('content-length', '0')) > max_body:
+        raise HttpError(f'Body of {headers["content-length"]} bytes is over the limit of {max_body}')
+    return parts[0], parts[1], headers, await read_body(reader, headers)
+
+def write_response(writer: asyncio.StreamWriter, status: int, body: bytes, keep_alive: bool = True, content_type: str = 'application/json'):
+    writer.write((
+        f'HTTP/1.1 {status} {REASONS.get(status, "Unknown")}\r\n'
+        f'Content-Type: {content_type}\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+    ).encode('latin-1') + body)
+
+class HttpPool:
+    def __init__(self, url: str, size: int = 16, timeout: float = 10.0):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != 'http':
+            raise HttpError(f'Unsupported scheme {parsed.scheme}')
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(size)
+        self.idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    # (reader, writer, reused)
+    async def connection(self):
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        return reader, writer, False
+
+    async def exchange(self, reader, writer, method: str, path: str, body: bytes, content_type: str, reused: bool):
+        writer.write((
+            f'{method} {path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: keep-alive\r\n\r\n'
+        ).encode('latin-1') + body)
+        try:
+            await writer.drain()
+            status_line = await reader.readline()
+        except OSError as e:
+            if reused:
+                raise StaleConnectionError(f'{type(e).__name__}: {e}')
+            raise
+        if not status_line:
+            if reused:
+                raise StaleConnectionError('Connection closed before response')
+            raise HttpError('Connection closed before response')
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise HttpError(f'Malformed status line {status_line[:100]!r}')
+        headers = await read_headers(reader)
+        return Response(status, headers, await read_body(reader, headers))
+
+    async def request(self, method: str, path: str, body: bytes = b'', content_type: str = 'application/json'):
+        async with self.slots:
+            reader, writer, reused = await asyncio.wait_for(self.connection(), self.timeout)
+            while True:
+                try:
+                    response = await asyncio.wait_for(self.exchange(reader, writer, method, path, body, content_type, reused), self.timeout)
+                    break
+                except StaleConnectionError:
+                    writer.close()
+                except Exception as e:
+                    writer.close()
+                    raise RequestSentError(f'{type(e).__name__}: {e}') from e
+                except BaseException:
+                    writer.close()
+                    raise
+                # Once more on a fresh connection, which cannot be stale
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                reused = False
+            if response.headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self.idle.append((reader, writer))
+            return response
+
+    async def post_json(self, path: str, data):
+        return await self.request('POST', path, json.dumps(data).encode('utf-8'))
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
@@ -0,0 +1,528 @@
+from compiler import *
+from codec import MESSAGE_SCHEMA
+import hashlib
+
+UINT64_MASK = (1 << 64) - 1
+MAX_STEPS = 1_000_000
+STOP = -1
+
+INTERNAL = 0
+EXTERNAL = 1
+ENTRIES = ('internal', 'external', 'view')
+
+class ExecutionError(Exception):
+    def __init__(self, message: str, offset: int | None = None):
+        super().__init__(message if offset is None else f'{message} (at offset {offset})')
+        self.offset = offset
+
+class Slice:
+    __slots__ = ('bt', 'position')
+
+    def __init__(self, bt: bytes):
+        self.bt = bt
+        self.position = 0
+
+    def read(self, size: int):
+        end = self.position + size
+        if end > len(self.bt):
+            raise ExecutionError(f'Slice has {len(self.bt) - self.position} bytes left, {size} requested')
+        value = self.bt[self.position:end]
+        self.position = end
+        return value
+
+class Builder:
+    __slots__ = ('bt',)
+
+    def __init__(self):
+        self.bt = bytearray()
+
+class Message:
+    def __init__(self, type: int, sender: bytes, receiver: bytes, init: bytes, opcode: int, data: bytes, timestamp: int):
+        self.type = type
+        self.sender = sender
+        self.receiver = receiver
+        self.init = init
+        self.opcode = opcode
+        self.data = data
+        self.timestamp = timestamp
+        # Set when the message was decoded from these exact bytes
+        self.encoded: bytes | None = None
+
+    # [type, sender, receiver, init, opcode, data, timestamp] as read back by MKSLICE/IREAD/BREAD
+    def encode(self):
+        if self.encoded is not None:
+            return self.encoded
+        return MESSAGE_SCHEMA.encode((self.type, self.sender, self.receiver, self.init, self.opcode, self.data, self.timestamp))
+
+    # Blocks stay views into data
+    @staticmethod
+    def decode(data: memoryview, offset: int = 0):
+        values, end = MESSAGE_SCHEMA.decode(data, offset)
+        message = Message(*values)
+        message.encoded = bytes(data[offset:end])
+        return message, end
+
+    def __str__(self):
+        return f'Message(type={self.type}, sender={self.sender.hex()}, receiver={self.receiver.hex()}, opcode={self.opcode}, data={self.data.hex()})'
+
+    def __repr__(self):
+        return self.__str__()
+
+class Execution:
+    def __init__(self, stack: list, data: bytes, sent: list[Message], steps: int):
+        self.stack = stack
+        self.data = data
+        self.sent = sent
+        self.steps = steps
+
+def expect_bytes(value):
+    if not isinstance(value, bytes):
+        raise ExecutionError(f'Expected bytes, got {type(value).__name__}')
+    return value
+
+def expect_uint64(value):
+    if not isinstance(value, int) or not 0 <= value <= UINT64_MASK:
+        raise ExecutionError(f'Expected a uint64, got {value!r}')
+    return value
+
+def op_invalid(vm, arg):
+    raise ExecutionError(f'Invalid opcode {arg}')
+
+def op_invalid_target(vm, arg):
+    raise ExecutionError('Jump into the middle of an instruction')
+
+def op_push(vm, arg):
+    vm.stack.append(arg)
+
+def op_spush(vm, arg):
+    vm.stack.append(vm.stack[-1 - arg])
+
+def op_dropn(vm, arg):
+    if arg > len(vm.stack):
+        raise ExecutionError(f'Cannot drop {arg} of {len(vm.stack)} values')
+    if arg:
+        del vm.stack[-arg:]
+
+def op_chg(vm, arg):
+    stack = vm.stack
+    first, second = -1 - arg[0], -1 - arg[1]
+    stack[first], stack[second] = stack[second], stack[first]
+
+def op_swap(vm, arg):
+    stack = vm.stack
+    stack[-1], stack[-2] = stack[-2], stack[-1]
+
+def op_bhash(vm, arg):
+    vm.stack.append(hashlib.sha256(expect_bytes(vm.stack.pop())).digest())
+
+def op_blen(vm, arg):
+    vm.stack.append(len(expect_bytes(vm.stack[-1])))
+
+def op_mkslice(vm, arg):
+    vm.stack.append(Slice(expect_bytes(vm.stack.pop())))
+
+def op_iread64(vm, arg):
+    vm.stack.append(int.from_bytes(vm.stack[-1].read(UINT64_SIZE), byteorder='big'))
+
+def op_iread8(vm, arg):
+    vm.stack.append(vm.stack[-1].read(1)[0])
+
+def op_bread(vm, arg):
+    size = vm.stack.pop()
+    vm.stack.append(vm.stack[-1].read(size))
+
+def op_sllen(vm, arg):
+    value = vm.stack[-1]
+    vm.stack.append(len(value.bt) - value.position)
+
+def op_mkbuilder(vm, arg):
+    vm.stack.append(Builder())
+
+def op_iwrite64(vm, arg):
+    value = vm.stack.pop()
+    vm.stack[-1].bt += value.to_bytes(UINT64_SIZE, byteorder='big')
+
+def op_iwrite8(vm, arg):
+    value = vm.stack.pop()
+    vm.stack[-1].bt += value.to_bytes(1, byteorder='big')
+
+def op_bwrite(vm, arg):
+    value = expect_bytes(vm.stack.pop())
+    vm.stack[-1].bt += value
+
+def op_build(vm, arg):
+    vm.stack.append(bytes(vm.stack.pop().bt))
+
+def op_bllen(vm, arg):
+    vm.stack.append(len(vm.stack[-1].bt))
+
+def op_add(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append((vm.stack.pop() + second) & UINT64_MASK)
+
+def op_sub(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append((vm.stack.pop() - second) & UINT64_MASK)
+
+def op_mul(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append((vm.stack.pop() * second) & UINT64_MASK)
+
+def op_div(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append(vm.stack.pop() // second)
+
+def op_mod(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append(vm.stack.pop() % second)
+
+def op_inc(vm, arg):
+    vm.stack[-1] = (vm.stack[-1] + 1) & UINT64_MASK
+
+def op_cmb(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append(int(vm.stack.pop() > second))
+
+def op_cml(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append(int(vm.stack.pop() < second))
+
+def op_cmbe(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append(int(vm.stack.pop() >= second))
+
+def op_cmle(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append(int(vm.stack.pop() <= second))
+
+def op_cme(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append(int(vm.stack.pop() == second))
+
+def op_cmne(vm, arg):
+    second = vm.stack.pop()
+    vm.stack.append(int(vm.stack.pop() != second))
+
+def op_jmp(vm, arg):
+    return arg
+
+def op_jmt(vm, arg):
+    if vm.stack.pop():
+        return arg
+
+def op_jmf(vm, arg):
+    if not vm.stack.pop():
+        return arg
+
+def op_call(vm, arg):
+    vm.calls.append(arg[1])
+    return arg[0]
+
+def op_ret(vm, arg):
+    if vm.calls:
+        return vm.calls.pop()
+    return STOP
+
+def op_halt(vm, arg):
+    return STOP
+
+def op_ldata(vm, arg):
+    vm.stack.append(vm.data)
+
+def op_sdata(vm, arg):
+    vm.data = expect_bytes(vm.stack.pop())
+
+def op_message(vm, arg):
+    if vm.message is None:
+        raise ExecutionError('No message to read')
+    # The codec reports values it cannot encode with a plain Exception
+    try:
+        vm.stack.append(vm.message.encode())
+    except Exception as e:
+        raise ExecutionError(f'Cannot encode message: {e}')
+
+def op_send(vm, arg):
+    stack = vm.stack
+    body = expect_bytes(stack.pop())
+    opcode = expect_uint64(stack.pop())
+    init = expect_bytes(stack.pop())
+    receiver = expect_bytes(stack.pop())
+    timestamp = vm.message.timestamp if vm.message is not None else 0
+    vm.sent.append(Message(INTERNAL, vm.address, receiver, init, opcode, body, timestamp))
+
+HANDLERS = {
+    'IPUSH64': op_push,
+    'IPUSH8': op_push,
+    'SPUSH': op_spush,
+    'BPUSH': op_push,
+    'DROPN': op_dropn,
+    'CHG': op_chg,
+    'SWAP': op_swap,
+
+    'BHASH': op_bhash,
+    'BLEN': op_blen,
+
+    'MKSLICE': op_mkslice,
+    'IREAD64': op_iread64,
+    'IREAD8': op_iread8,
+    'BREAD': op_bread,
+    'SLLEN': op_sllen,
+
+    'MKBUILDER': op_mkbuilder,
+    'IWRITE64': op_iwrite64,
+    'IWRITE8': op_iwrite8,
+    'BWRITE': op_bwrite,
+    'BUILD': op_build,
+    'BLLEN': op_bllen,
+
+    'ADD': op_add,
+    'SUB': op_sub,
+    'MUL': op_mul,
+    'DIV': op_div,
+    'MOD': op_mod,
+    'INC': op_inc,
+
+    'CMB': op_cmb,
+    'CML': op_cml,
+    'CMBE': op_cmbe,
+    'CMLE': op_cmle,
+    'CME': op_cme,
+    'CMNE': op_cmne,
+
+    'JMP': op_jmp,
+    'JMT': op_jmt,
+    'JMF': op_jmf,
+    'RJMP': op_jmp,
+    'RJMT': op_jmt,
+    'RJMF': op_jmf,
+    'CALL': op_call,
+    'RET': op_ret,
+
+    'HALT': op_halt,
+
+    'LDATA': op_ldata,
+    'SDATA': op_sdata,
+    'MESSAGE': op_message,
+    'SEND': op_send,
+}
+
+# Fused handlers stand for a whole idiom; arg[0] is the idiom, arg[1] the op after it
+def op_read_block_swap(vm, arg):
+    stack = vm.stack
+    value = stack[-1]
+    stack[-1] = value.read(int.from_bytes(value.read(UINT64_SIZE), byteorder='big'))
+    stack.append(value)
+    vm.fired[arg[0]] += 1
+    return arg[1]
+
+def op_read_block_chg_swap(vm, arg):
+    stack = vm.stack
+    value = stack[-1]
+    stack.append(value.read(int.from_bytes(value.read(UINT64_SIZE), byteorder='big')))
+    first, second = arg[2]
+    stack[first], stack[second] = stack[second], stack[first]
+    stack[-1], stack[-2] = stack[-2], stack[-1]
+    vm.fired[arg[0]] += 1
+    return arg[1]
+
+def op_jump_equal(vm, arg):
+    vm.fired[arg[0]] += 1
+    if vm.stack.pop() == arg[2]:
+        return arg[3]
+    return arg[1]
+
+def op_jump_not_equal(vm, arg):
+    vm.fired[arg[0]] += 1
+    if vm.stack.pop() != arg[2]:
+        return arg[3]
+    return arg[1]
+
+def op_chg_dropn(vm, arg):
+    stack = vm.stack
+    first, second = arg[2]
+    stack[first], stack[second] = stack[second], stack[first]
+    count = arg[3]
+    if count > len(stack):
+        raise ExecutionError(f'Cannot drop {count} of {len(stack)} values')
+    if count:
+        del stack[-count:]
+    vm.fired[arg[0]] += 1
+    return arg[1]
+
+def chg_indexes(operands):
+    return -1 - operands[0], -1 - operands[1]
+
+def fuse_read_block_swap(names: list, args: list):
+    return op_read_block_swap, ()
+
+def fuse_read_block_chg_swap(names: list, args: list):
+    return op_read_block_chg_swap, (chg_indexes(args[2]),)
+
+# IPUSH k, CME or CMNE, then a conditional jump: one comparison with k decides the branch
+def fuse_compare_jump(names: list, args: list):
+    equal = (names[1] == 'CME') == (names[2] in ('JMT', 'RJMT'))
+    return op_jump_equal if equal else op_jump_not_equal, (args[0], args[2])
+
+def fuse_chg_dropn(names: list, args: list):
+    return op_chg_dropn, (chg_indexes(args[0]), args[1])
+
+# Longest first; a position takes the first idiom that matches
+FUSIONS = (
+    ('IREAD64 BREAD CHG SWAP', (('IREAD64',), ('BREAD',), ('CHG',), ('SWAP',)), fuse_read_block_chg_swap),
+    ('IREAD64 BREAD SWAP', (('IREAD64',), ('BREAD',), ('SWAP',)), fuse_read_block_swap),
+    ('IPUSH CMx JMx', (('IPUSH8', 'IPUSH64'), ('CME', 'CMNE'), ('JMT', 'JMF', 'RJMT', 'RJMF')), fuse_compare_jump),
+    ('CHG DROPN', (('CHG',), ('DROPN',)), fuse_chg_dropn),
+)
+
+RUNTIME_ERRORS = (IndexError, TypeError, AttributeError, ValueError, OverflowError, ZeroDivisionError)
+
+class Machine:
+    def __init__(self, program: bytes, address: bytes = b'', max_steps: int = MAX_STEPS, fuse: bool = True):
+        program = memoryview(program)
+        self.entries, header_size = parse_header(program)
+        self.code = program[header_size:]
+        self.address = address
+        self.max_steps = max_steps
+        self.names: list[str | None] = []
+        self.offsets: list[int] = []
+        self.ops: list[tuple] = []
+        self.index: dict[int, int] = {}
+        self.decode()
+        # Instructions each op stands for, and the op it replaced, so the step limit falls where it would unfused
+        self.weights = [1] * len(self.ops)
+        self.plain = list(self.ops)
+        self.sites = [0] * len(FUSIONS)
+        self.fired = [0] * len(FUSIONS)
+        if fuse:
+            self.fuse()
+        self.stack: list = []
+        self.calls: list[int] = []
+        self.data = b''
+        self.message: Message | None = None
+        self.sent: list[Message] = []
+
+    def append(self, name: str | None, offset: int, handler, arg):
+        self.names.append(name)
+        self.offsets.append(offset)
+        self.ops.append((handler, arg))
+
+    def decode(self):
+        code = self.code
+        offset = 0
+        while offset < len(code):
+            name = MNEMONICS.get(code[offset])
+            if name is None:
+                self.append(None, offset, op_invalid, code[offset])
+                offset += 1
+                continue
+            try:
+                operands, size = INSTRUCTIONS[name].decode(code, offset)
+            except Exception:
+                self.append(None, offset, op_invalid, code[offset])
+                offset = len(code)
+                continue
+            if len(operands) == 0:
+                arg = None
+            elif len(operands) == 1:
+                arg = operands[0]
+                if isinstance(arg, memoryview):
+                    arg = bytes(arg)
+            else:
+                arg = operands
+            self.append(name, offset, HANDLERS[name], arg)
+            offset += size
+        count = len(self.ops)
+        self.index = {offset: i for i, offset in enumerate(self.offsets)}
+        self.append(None, len(code), op_halt, None)
+        self.index[len(code)] = count
+        for i in range(count):
+            name = self.names[i]
+            if name is None or not isinstance(INSTRUCTIONS[name], Jmp):
+                continue
+            handler, target = self.ops[i]
+            if target not in self.index:
+                self.index[target] = len(self.ops)
+                self.append(None, target, op_invalid_target, None)
+            arg = self.index[target]
+            if handler is op_call:
+                arg = (arg, i + 1)
+            self.ops[i] = (handler, arg)
+
+    # Ops inside a fused idiom stay in place but are never dispatched; no idiom may contain a jump target
+    def fuse(self):
+        count = self.index[len(self.code)]
+        targets = {self.index[offset] for offset in self.entries if offset in self.index}
+        for i in range(count):
+            name = self.names[i]
+            if name is not None and isinstance(INSTRUCTIONS[name], Jmp):
+                arg = self.ops[i][1]
+                targets.update(arg if isinstance(arg, tuple) else (arg,))
+        i = 0
+        while i < count:
+            for n, (_, pattern, build) in enumerate(FUSIONS):
+                end = i + len(pattern)
+                if end > count or any(self.names[i + k] not in names for k, names in enumerate(pattern)):
+                    continue
+                if any(k in targets for k in range(i + 1, end)):
+                    continue
+                handler, arg = build(self.names[i:end], [arg for _, arg in self.ops[i:end]])
+                self.ops[i] = (handler, (n, end) + arg)
+                self.weights[i] = end - i
+                self.sites[n] += 1
+                i = end
+                break
+            else:
+                i += 1
+
+    def fusion_stats(self):
+        return [(name, sites, fired) for (name, _, _), sites, fired in zip(FUSIONS, self.sites, self.fired) if sites]
+
+    def run(self, entry: str, data: bytes = b'', message: Message | None = None):
+        start = self.entries[ENTRIES.index(entry)]
+        if start is None:
+            raise ExecutionError(f'Program has no .{entry} entry')
+        if start not in self.index:
+            raise ExecutionError(f'Entry .{entry} is not an instruction boundary', start)
+        self.stack = []
+        self.calls = []
+        self.data = data
+        self.message = message
+        self.sent = []
+        steps = self.execute(self.index[start])
+        return Execution(self.stack, self.data, self.sent, steps)
+
+    # A fused op counts every instruction of its idiom; one that would cross the limit runs its first instruction alone
+    def execute(self, ip: int):
+        ops = self.ops
+        weights = self.weights
+        limit = self.max_steps
+        steps = 0
+        try:
+            while True:
+                steps += weights[ip]
+                if steps <= limit:
+                    handler, arg = ops[ip]
+                else:
+                    steps -= weights[ip] - 1
+                    if steps > limit:
+                        raise ExecutionError(f'Step limit of {limit} exceeded', self.offsets[ip])
+                    handler, arg = self.plain[ip]
+                ip += 1
+                jump = handler(self, arg)
+                if jump is not None:
+                    if jump < 0:
+                        break
+                    ip = jump
+        except (ExecutionError,) + RUNTIME_ERRORS as e:
+            raise self.fault(e, ip - 1)
+        return steps
+
+    def fault(self, e: Exception, i: int):
+        if isinstance(e, ExecutionError):
+            if e.offset is not None:
+                return e
+            error = ExecutionError(str(e), self.offsets[i])
+        else:
+            error = ExecutionError(f'{self.names[i]}: {type(e).__name__}: {e}', self.offsets[i])
+        error.__cause__ = e
+        return error
@@ -0,0 +1,90 @@
+from tokenizer import tokenize_file
+from analyser import Analyser
+from compiler import Compiler, build_executive
+from linker import Linker
+from objectfile import ObjectFile
+import hashlib
+import os
+import time
+
+def stamp(path: str):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+class Watcher:
+    def __init__(self, roots: list[str]):
+        self.roots = [os.path.realpath(root) for root in roots]
+        self.objects: dict[str, tuple[tuple[int, int], ObjectFile]] = {}
+        self.stamps: dict[str, tuple[int, int] | None] = {}
+        self.sizes: dict[str, int] = {}
+
+    def load(self, path: str):
+        self.stamps[path] = None
+        current = stamp(path)
+        self.stamps[path] = current
+        cached = self.objects.get(path)
+        if cached is not None and cached[0] == current:
+            return cached[1]
+        analyser = Analyser(tokenize_file(path), path, follow_includes=False)
+        analyser.analys()
+        obj = Compiler(analyser.program).compile_object(path)
+        self.objects[path] = (current, obj)
+        return obj
+
+    def closure(self, root: str):
+        paths = []
+        pending = [root]
+        while pending:
+            path = pending.pop()
+            if path in paths:
+                continue
+            paths.append(path)
+            pending.extend(reversed(self.load(path).includes))
+        return paths
+
+    def changed(self):
+        changed = set()
+        for path, known in self.stamps.items():
+            try:
+                current = stamp(path)
+            except FileNotFoundError:
+                current = None
+            if current != known:
+                changed.add(path)
+        return changed
+
+    def build(self, root: str):
+        start = time.perf_counter()
+        linker = Linker([self.load(path) for path in self.closure(root)])
+        program = linker.link()
+        elapsed = time.perf_counter() - start
+        name = os.path.relpath(root)
+        delta = len(program) - self.sizes.get(root, len(program))
+        self.sizes[root] = len(program)
+        if linker.initial_data is None:
+            return f'{name}: {len(program)} bytes ({delta:+}) in {1000 * elapsed:.1f} ms, no .data'
+        address = hashlib.sha256(build_executive(program, linker.initial_data)).digest()
+        return f'{name}: address {address.hex()} {len(program)} bytes ({delta:+}) in {1000 * elapsed:.1f} ms'
+
+    def rebuild(self, roots: list[str]):
+        for root in roots:
+            try:
+                yield self.build(root)
+            except Exception as e:
+                yield f'{os.path.relpath(root)}: {type(e).__name__}: {e}'
+
+    def watch(self, interval: float = 0.2):
+        yield from self.rebuild(self.roots)
+        while True:
+            time.sleep(interval)
+            changed = self.changed()
+            if not changed:
+                continue
+            affected = []
+            for root in self.roots:
+                try:
+                    if root in changed or changed.intersection(self.closure(root)):
+                        affected.append(root)
+                except Exception:
+                    affected.append(root)
+            yield from self.rebuild(affected)